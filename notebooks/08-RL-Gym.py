@@ -27,7 +27,7 @@ logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
 # In[16]:
 
 
-import evsim
+import evsim.envs
 import numpy as np
 import gym
 
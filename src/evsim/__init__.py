@@ -1,7 +1,20 @@
 # flake8: noqa
-import evsim.simulation
-from evsim.simulation import statistic
+import importlib
+import sys
 
-from gym.envs.registration import register
+# NOTE: The simulation is imported on first access, to keep the CLI light.
+# The gym environment is registered by evsim.envs, or right away if gym is
+# already loaded.
+_lazy = {"simulation": "evsim.simulation", "statistic": "evsim.simulation.statistic"}
 
-register(id="evsim-v0", entry_point="evsim.envs:FleetEnv")
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError("module 'evsim' has no attribute '%s'" % name)
+    module = importlib.import_module(_lazy[name])
+    globals()[name] = module
+    return module
+
+
+if "gym" in sys.modules:
+    import evsim.envs
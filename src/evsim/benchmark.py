@@ -0,0 +1,413 @@
+from datetime import datetime
+import json
+import logging
+from pathlib import Path
+import platform
+import time
+import numpy as np
+import pandas as pd
+import simpy
+
+from evsim import entities
+from evsim.controller import Controller, strategy
+from evsim.data import balancing, car2go, synthetic
+from evsim.market import Market
+from evsim.simulation import LockstepSimulation, Simulation, SimulationConfig
+
+logger = logging.getLogger(__name__)
+
+# Fleet size of the fixtures is multiplied by the scale
+SCALES = {"small": 1, "medium": 10, "large": 100}
+
+# Fixed start of all fixtures
+START = int(datetime(2018, 1, 1).timestamp())
+DAYS = 7
+EVS = 25
+
+
+def _trip_model(rng):
+    """Trip model of a car2go like fleet, with 8 trips per EV and day"""
+    n = 1000
+    duration = rng.randint(5, 120, n)
+    return {
+        "rate": np.full(synthetic.week // synthetic.timeslot, 8 / 288),
+        "trips": pd.DataFrame(
+            {
+                "trip_duration": duration,
+                "soc_delta": rng.uniform(-2, 8, n),
+                "end_charging": (rng.uniform(size=n) < 0.17).astype(np.int8),
+                "trip_distance": rng.uniform(0, 30, n),
+                "trip_price": duration * 0.24,
+                "start_lat": rng.uniform(48.7, 48.8, n),
+                "start_lon": rng.uniform(9.1, 9.2, n),
+                "end_lat": rng.uniform(48.7, 48.8, n),
+                "end_lon": rng.uniform(9.1, 9.2, n),
+            }
+        ),
+        "start_soc": rng.uniform(20, 100, n),
+    }
+
+
+def trips(scale):
+    rng = np.random.RandomState(0)
+    end = START + DAYS * synthetic.day
+    return synthetic.generate(_trip_model(rng), EVS * scale, START, end, seed=0)
+
+
+def dwells(scale):
+    """Dwells of EVs at random locations, as compressed from snapshots"""
+    rng = np.random.RandomState(0)
+    per_ev = DAYS * 24
+    n = EVS * scale * per_ev
+    timestamp = START + np.tile(np.arange(per_ev), EVS * scale) * 60 * 60
+    fuel = rng.uniform(10, 100, n)
+    charging = (rng.uniform(size=n) < 0.1).astype(np.int8)
+    return pd.DataFrame(
+        {
+            "name": np.repeat(["S-GO%05d" % i for i in range(EVS * scale)], per_ev),
+            "coordinates_lat": rng.uniform(48.7, 48.8, n).round(4),
+            "coordinates_lon": rng.uniform(9.1, 9.2, n).round(4),
+            "timestamp": timestamp,
+            "timestamp_last": timestamp + 30 * 60,
+            "fuel": fuel,
+            "fuel_last": fuel,
+            "fuel_min": fuel,
+            "fuel_max": fuel,
+            "charging": charging,
+            "charging_any": charging,
+        }
+    )
+
+
+def tender_results(days):
+    """Tender results of negative control reserve, 10 bids per product"""
+    rng = np.random.RandomState(0)
+    rows = list()
+    for d in pd.date_range(datetime.fromtimestamp(START), periods=days, freq="D"):
+        for product_time in ["HT", "NT"]:
+            allocated = rng.uniform(1, 100, 10)
+            prices = np.sort(rng.uniform(-100, 500, 10))[::-1]
+            for cumsum, price in zip(np.cumsum(allocated), prices):
+                rows.append((d, d, "NEG", product_time, price, cumsum))
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "from",
+            "to",
+            "product_type",
+            "product_time",
+            "energy_price_mwh",
+            "cumsum_allocated_mw",
+        ],
+    )
+
+
+def activated_reserve(days):
+    rng = np.random.RandomState(0)
+    start = pd.date_range(
+        datetime.fromtimestamp(START), periods=days * 96, freq="15min"
+    )
+    return pd.DataFrame(
+        {
+            "from": start,
+            "to": start + pd.Timedelta(minutes=15),
+            "neg_mw": rng.uniform(0, 100, len(start)),
+            "pos_mw": rng.uniform(0, 100, len(start)),
+        }
+    )
+
+
+def prices(days):
+    rng = np.random.RandomState(0)
+    # Prices start a week early, for the lead time of balancing bids
+    product_time = pd.date_range(
+        datetime.fromtimestamp(START - synthetic.week),
+        periods=(days + 14) * 96,
+        freq="15min",
+    )
+    return pd.DataFrame(
+        {
+            "product_time": product_time,
+            "clearing_price_mwh": rng.uniform(-50, 100, len(product_time)),
+        }
+    )
+
+
+def _market_controller(cfg, s, scale, **kwargs):
+    return Controller(
+        cfg,
+        s,
+        fleet_capacity=fleet_capacity(DAYS, scale),
+        balancing_prices=prices(DAYS),
+        intraday_prices=prices(DAYS),
+        **kwargs
+    )
+
+
+def fleet_capacity(days, scale):
+    rng = np.random.RandomState(0)
+    timestamp = START + np.arange((days + 14) * 288) * synthetic.timeslot
+    return pd.DataFrame(
+        {
+            "timestamp": timestamp,
+            "vpp_charging_power_kw": rng.randint(0, EVS * scale, len(timestamp)) * 3.6,
+        }
+    )
+
+
+# Benchmarks set up their fixtures and return a function to time, the
+# number of items it processes and their unit
+
+
+def bench_calculate_trips(scale):
+    df = dwells(scale)
+    return lambda: car2go.partition_trips([df], dict()), len(df), "dwells"
+
+
+def bench_calculate_capacity(scale):
+    df = trips(scale)
+    nb_slots = DAYS * 288
+    return lambda: car2go.calculate_capacity(df, 3.6, 17.6), nb_slots, "slots"
+
+
+def bench_clearing_prices(scale):
+    days = DAYS * scale
+    df_results, df_reserve = tender_results(days), activated_reserve(days)
+    return (
+        lambda: balancing.calculate_clearing_prices(df_results, df_reserve),
+        len(df_reserve),
+        "rows",
+    )
+
+
+def bench_simulation_step(scale):
+    cfg = SimulationConfig("benchmark")
+    sim = Simulation(cfg, Controller(cfg, strategy.regular), trips(scale))
+
+    def run():
+        while not sim.done:
+            sim.step()
+
+    nb_slots = (sim.end_time - sim.start_time) // synthetic.timeslot
+    return run, nb_slots, "slots"
+
+
+def bench_charge_fleet(scale):
+    cfg = SimulationConfig("benchmark")
+    nb_evs = EVS * scale
+    controller = _market_controller(cfg, strategy.integrated, scale)
+    env = simpy.Environment(initial_time=START)
+    vpp = entities.VPP(env, "VPP", nb_evs, cfg.charging_power)
+    for i in range(nb_evs):
+        vpp.add(
+            entities.EV(
+                env,
+                vpp,
+                i,
+                i,
+                10,
+                cfg.ev_capacity,
+                cfg.charging_power,
+                cfg.control_period,
+            )
+        )
+    controller.env, controller.vpp = env, vpp
+
+    # EVs are full after about 50 timeslots
+    nb_slots = 48
+
+    def run():
+        for t in range(
+            START, START + nb_slots * synthetic.timeslot, synthetic.timeslot
+        ):
+            env.run(until=t + 1)
+            controller.charge_fleet(t)
+
+    return run, nb_slots, "slots"
+
+
+def bench_clearing_price(scale):
+    market = Market(prices(DAYS))
+    rng = np.random.RandomState(0)
+    timeslots = (START + rng.randint(0, DAYS * 96, 10000 * scale) * 900).tolist()
+
+    def run():
+        for t in timeslots:
+            market.clearing_price(t)
+
+    return run, len(timeslots), "lookups"
+
+
+BENCHMARKS = {
+    "calculate_trips": bench_calculate_trips,
+    "calculate_capacity": bench_calculate_capacity,
+    "calculate_clearing_prices": bench_clearing_prices,
+    "simulation_step": bench_simulation_step,
+    "charge_fleet": bench_charge_fleet,
+    "clearing_price": bench_clearing_price,
+}
+
+
+# Checks run equivalent simulations and return the largest difference of
+# their stats and results by case, which has to be 0
+
+
+def _simulate(sim):
+    while not sim.done:
+        sim.step()
+    return sim
+
+
+def _difference(a, b):
+    """Largest absolute difference of the statistics, e.g. stats and
+    results, of two runs
+    """
+    diffs = list()
+    for x, y in zip(a, b):
+        x, y = pd.DataFrame(x.stats), pd.DataFrame(y.stats)
+        if x.shape != y.shape:
+            return np.inf
+        diffs.append(float((x - y).abs().max().max()) if len(x) else 0)
+    return max(diffs)
+
+
+def check_skip_quiet(scale):
+    """Skipping quiet timeslots against simulating every timeslot, for
+    the market strategies at the default and an hourly market period
+    """
+    df = trips(scale)
+    cases = dict()
+    for name in ["intraday", "integrated"]:
+        for market_period in [15, 60]:
+            cfg = SimulationConfig("check", market_period=market_period)
+            a, b = [
+                _simulate(
+                    Simulation(
+                        cfg,
+                        _market_controller(cfg, getattr(strategy, name), scale),
+                        df,
+                        skip_quiet=skip,
+                    )
+                )
+                for skip in [True, False]
+            ]
+            cases["%s-%dmin" % (name, market_period)] = _difference(
+                [a.stats, a.results], [b.stats, b.results]
+            )
+    return cases
+
+
+def check_lockstep(scale):
+    """Scenarios simulated in lockstep against separate simulations"""
+    df = trips(scale)
+    cfg = SimulationConfig("check")
+    scenarios = {
+        "regular": (strategy.regular, (0, 0), True),
+        "balancing": (strategy.balancing, (0.1, 0), True),
+        "intraday": (strategy.intraday, (0, 0.3), True),
+        "integrated": (strategy.integrated, (0, 0), True),
+        "integrated-no-refusals": (strategy.integrated, (0, 0), False),
+    }
+
+    def controllers():
+        return [
+            _market_controller(cfg, s, scale, risk=risk, refuse_rentals=refuse)
+            for s, risk, refuse in scenarios.values()
+        ]
+
+    lockstep = _simulate(LockstepSimulation(cfg, controllers(), df))
+    cases = dict()
+    for k, (name, controller) in enumerate(zip(scenarios, controllers())):
+        a = _simulate(Simulation(cfg, controller, df))
+        cases[name] = _difference(
+            [a.stats, a.results], [lockstep.stats[k], lockstep.results[k]]
+        )
+    return cases
+
+
+CHECKS = {
+    "skip_quiet": check_skip_quiet,
+    "lockstep": check_lockstep,
+}
+
+
+def check(scale="small", names=None, tolerance=1e-6):
+    """Runs the checks, a case fails if its difference exceeds the
+    tolerance.
+    """
+    rows = list()
+    for name, f in CHECKS.items():
+        if names and name not in names:
+            continue
+        for case, difference in f(SCALES[scale]).items():
+            rows.append((name, case, difference, difference <= tolerance))
+            logger.info("%s %s: %g" % (name, case, difference))
+    return pd.DataFrame(rows, columns=["check", "case", "difference", "ok"])
+
+
+def run(scale="small", repeat=3, names=None):
+    """Runs the benchmarks with fresh fixtures for every repetition and
+    returns the best time and the throughput of each.
+    """
+    results = dict()
+    for name, bench in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+
+        times = list()
+        for _ in range(repeat):
+            f, items, unit = bench(SCALES[scale])
+            start = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - start)
+
+        best = min(times)
+        results[name] = {
+            "seconds": best,
+            "items": int(items),
+            "unit": unit,
+            "rate": items / best,
+        }
+        logger.info("%s: %.0f %s/s" % (name, items / best, unit))
+
+    return {
+        "scale": scale,
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def save(report, filename):
+    filename = Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Change of the throughput of every benchmark against a baseline.
+    A benchmark regressed, if its throughput dropped by more than the
+    tolerance.
+    """
+    if report["scale"] != baseline["scale"]:
+        raise ValueError(
+            "Baseline is of scale %s, not %s." % (baseline["scale"], report["scale"])
+        )
+
+    rows = list()
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]["rate"]
+        change = result["rate"] / base - 1
+        rows.append((name, result["rate"], base, change, change < -tolerance))
+    return pd.DataFrame(
+        rows, columns=["benchmark", "rate", "baseline", "change", "regression"]
+    )
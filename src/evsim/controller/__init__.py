@@ -1,3 +1,13 @@
 # flake8: noqa
 from . import strategy
-from .controller import Controller
+
+
+# NOTE: The controller loads pandas, it is imported on first access to keep
+# clients of the controller daemon light
+def __getattr__(name):
+    if name != "Controller":
+        raise AttributeError("module 'evsim.controller' has no attribute '%s'" % name)
+    from .controller import Controller
+
+    globals()["Controller"] = Controller
+    return Controller
@@ -0,0 +1,65 @@
+import json
+import socket
+
+
+class Client:
+    """
+    Client of the controller daemon. Keeps one connection open for all
+    requests, a batch of requests is sent as one line.
+    """
+
+    def __init__(self, address, timeout=10):
+        host, port = parse_address(address)
+        if port is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(host)
+        else:
+            self.sock = socket.create_connection((host, port), timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, request):
+        """Sends a request or a list of requests and returns the response"""
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Controller daemon closed the connection")
+        return json.loads(line)
+
+    def call(self, method, **params):
+        """Calls a method of the daemon, raises ValueError on errors"""
+        response = self.request(dict(params, method=method))
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def batch(self, requests):
+        """Sends many requests at once, returns the responses in order"""
+        return self.request(list(requests))
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def connect(address, timeout=10):
+    """Connects to a running daemon, returns None if there is none"""
+    try:
+        return Client(address, timeout)
+    except OSError:
+        return None
+
+
+def parse_address(address):
+    """Returns (host, port) of a 'host:port' address, (path, None) else"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "localhost", int(port)
+    return address, None
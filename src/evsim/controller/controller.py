@@ -2,9 +2,11 @@ from datetime import datetime
 import logging
 from operator import attrgetter
 import random
+import numpy as np
 
 from evsim.data import load
 from evsim.market import Market
+from evsim.simulation.profile import NullProfile
 
 
 class Controller:
@@ -16,6 +18,9 @@ class Controller:
         risk=(0, 0),
         imbalance_costs=1000,
         refuse_rentals=True,
+        fleet_capacity=None,
+        balancing_prices=None,
+        intraday_prices=None,
     ):
         self.logger = logging.getLogger(__name__)
 
@@ -28,19 +33,36 @@ class Controller:
         self.intraday_plan = ConsumptionPlan("Intraday")
 
         # NOTE: When regular strategy no need for capacity and price data
+        # Data that is already loaded can be passed in, e.g. shared by many runs
         if strategy.__name__ != "regular":
-            self.fleet_capacity = load.simulation_baseline()
-            self.balancing_market = Market(load.balancing_prices())
-            self.intraday_market = Market(load.intraday_prices())
+            if fleet_capacity is None:
+                fleet_capacity = load.simulation_baseline()
+            if balancing_prices is None:
+                balancing_prices = load.balancing_prices()
+            if intraday_prices is None:
+                intraday_prices = load.intraday_prices()
+
+            self.fleet_capacity = fleet_capacity
+            self._capacity = _index_capacity(fleet_capacity)
+            self._capacity_ts = np.fromiter(self._capacity.keys(), dtype=np.int64)
+            self._capacity_kw = np.fromiter(self._capacity.values(), dtype=np.float64)
+            order = np.argsort(self._capacity_ts)
+            self._capacity_ts = self._capacity_ts[order]
+            self._capacity_kw = self._capacity_kw[order]
+            self.balancing_market = Market(balancing_prices)
+            self.intraday_market = Market(intraday_prices)
 
         # Risk parameter set from outside, i.e. RL Agent
         self._risk = risk
-        # Imbalance Costs for learning
+        # Imbalance Costs for learning, in EUR per kWh not charged in a
+        # control period. NOTE: Before periods were configurable, a full
+        # market period was counted every 5 minutes, tripling the penalty.
         self.imbalance_costs = imbalance_costs
 
         # Reference simulation objects
         self.env = None
         self.vpp = None
+        self.profile = NullProfile()
 
         # Strategy specific optionals
         self.refuse_rentals = refuse_rentals
@@ -49,14 +71,11 @@ class Controller:
         if level is None:
             level = self.logger.info
 
+        # NOTE: Outside of a simulation, e.g. when serving predictions
+        now = datetime.fromtimestamp(self.env.now) if self.env else "-"
         level(
             "[%s] - %s(%s) %s"
-            % (
-                datetime.fromtimestamp(self.env.now),
-                type(self).__name__,
-                self.strategy.__name__,
-                message,
-            )
+            % (now, type(self).__name__, self.strategy.__name__, message,)
         )
 
     def error(self, message):
@@ -78,6 +97,12 @@ class Controller:
             raise ValueError("Only risk factors between 0 and 1 are valid: %s" % i)
         self._risk = value
 
+    def reset(self):
+        """Resets plans and account for a new run, keeps the loaded data"""
+        self.account = Account()
+        self.balancing_plan = ConsumptionPlan("Balancing")
+        self.intraday_plan = ConsumptionPlan("Intraday")
+
     def planned_kw(self, t):
         return self.balancing_plan.get(t) + self.intraday_plan.get(t)
 
@@ -114,7 +139,9 @@ class Controller:
         regular_charged_kwh = self._evs_to_kwh(len(available_evs))
 
         # 5. Execute Bidding strategy
+        self.profile.lap("charge_fleet")
         profit = self.strategy(self, timeslot, self.risk, self.accuracy)
+        self.profile.lap("strategy")
 
         # 6. Account for cost and profits
         imbalance_eur = imbalance_kwh * self.imbalance_costs
@@ -135,7 +162,7 @@ class Controller:
         num_plan_evs = int(planned_kw // self.cfg.charging_power)
         self.log(
             "Consumption plan (%s): %.2fkWh, required EVs: %d."
-            % (plan.name, planned_kw * (15 / 60), num_plan_evs)
+            % (plan.name, planned_kw * (self.cfg.control_period / 60), num_plan_evs)
         )
 
         # 1. Handle overcommitments
@@ -172,32 +199,30 @@ class Controller:
 
     # TODO: Better distort data for prediction
     def predict_capacity(self, timeslot, accuracy=100):
-        """ Predict the available capacity for a given 5min timeslot.
+        """ Predict the available capacity for a given control period.
         Takes a dataframe and timeslot (POSIX timestamp) as input.
         Returns the predicted fleet capacity in kW.
         """
-        df = self.fleet_capacity
         try:
 
             # NOTE: Simple uniform distortion.
             # Improve by gaussian with mean = accuracy
             range = 1 - (accuracy / 100)
             distortion = random.uniform(1 - range, 1 + range)  # e.g. [0.9, 1.1]
-            cap = df.loc[df["timestamp"] == timeslot, "vpp_charging_power_kw"].iat[0]
-            return cap * distortion
-        except IndexError:
+            return self._capacity[timeslot] * distortion
+        except KeyError:
             raise ValueError(
                 "Capacity prediction failed: %s is not in data."
                 % datetime.fromtimestamp(timeslot)
             )
 
     def predict_min_capacity(self, timeslot, accuracy=100):
-        """ Predict the minimum available capacity for a given 15min timeslot.
+        """ Predict the minimum available capacity for a given market period.
         Takes a dataframe and timeslot (POSIX timestamp) as input.
         Returns the predicted fleet capacity in kW.
         """
         cap = float("inf")
-        for t in [0, 5, 10]:
+        for t in range(0, self.cfg.market_period, self.cfg.control_period):
             try:
                 cap = min(cap, self.predict_capacity(timeslot + (60 * t), accuracy))
             except ValueError:
@@ -205,8 +230,8 @@ class Controller:
 
         if cap == float("inf"):
             raise ValueError(
-                "Capacity prediction failed: 15 min timeslot %s is not in data."
-                % datetime.fromtimestamp(timeslot)
+                "Capacity prediction failed: %d min timeslot %s is not in data."
+                % (self.cfg.market_period, datetime.fromtimestamp(timeslot))
             )
 
         self.log(
@@ -215,8 +240,48 @@ class Controller:
         )
         return cap
 
+    def predict_capacities(self, timeslots, accuracy=100):
+        """ Predict the available capacity for an array of control periods.
+        Returns the predicted fleet capacities in kW, NaN if not in data.
+        """
+        timeslots = np.asarray(timeslots, dtype=np.int64)
+        i = np.searchsorted(self._capacity_ts, timeslots)
+        i[i == len(self._capacity_ts)] = 0
+        found = self._capacity_ts[i] == timeslots
+
+        range = 1 - (accuracy / 100)
+        # Same generator as predict_capacity, whose state checkpoints restore
+        distortion = np.array(
+            [random.uniform(1 - range, 1 + range) for _ in timeslots], dtype=np.float64
+        )
+        return np.where(found, self._capacity_kw[i] * distortion, np.nan)
+
+    def predict_min_capacities(self, timeslots, accuracy=100):
+        """ Predict the minimum available capacity for an array of market
+        periods. Returns the predicted fleet capacities in kW, NaN if not
+        in data.
+        """
+        timeslots = np.asarray(timeslots, dtype=np.int64)
+        caps = [
+            self.predict_capacities(timeslots + (60 * t), accuracy)
+            for t in range(0, self.cfg.market_period, self.cfg.control_period)
+        ]
+        return np.fmin.reduce(caps)
+
     def _evs_to_kwh(self, nb_evs):
-        return (nb_evs * self.cfg.charging_power) * (15 / 60)
+        """Energy charged by the EVs in one control period"""
+        return (nb_evs * self.cfg.charging_power) * (self.cfg.control_period / 60)
+
+
+def _index_capacity(df):
+    """Fleet capacity in kW by timestamp, of the first row of each timestamp"""
+    first = ~df["timestamp"].duplicated()
+    return dict(
+        zip(
+            df.loc[first, "timestamp"].tolist(),
+            df.loc[first, "vpp_charging_power_kw"].tolist(),
+        )
+    )
 
 
 class ConsumptionPlan:
@@ -0,0 +1,202 @@
+from collections import Counter, defaultdict, deque
+import json
+import logging
+import math
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+
+import click
+import numpy as np
+
+from evsim.market import Bid
+from .client import parse_address
+
+logger = logging.getLogger(__name__)
+
+# Latencies kept per method for the percentiles of the metrics
+LATENCY_WINDOW = 10000
+
+
+class Service:
+    """
+    Answers requests of the controller daemon with a controller, which
+    keeps the capacity and price data loaded and indexed.
+
+    A request is a dict with the method and its parameters, e.g.
+    {"method": "capacity", "timeslot": 1514790300}. A list of requests is
+    answered as a batch, with one response per request. The plural methods
+    take a list of timeslots and are evaluated vectorized.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.methods = {
+            "capacity": self.capacity,
+            "min_capacity": self.min_capacity,
+            "clearing_price": self.clearing_price,
+            "bid": self.bid,
+            "capacities": self.capacities,
+            "min_capacities": self.min_capacities,
+            "clearing_prices": self.clearing_prices,
+            "metrics": self.metrics,
+        }
+
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.errors = Counter()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def handle(self, request):
+        if isinstance(request, list):
+            return [self.handle(r) for r in request]
+
+        start = time.perf_counter()
+        method = request.get("method") if isinstance(request, dict) else None
+        known = isinstance(method, str) and method in self.methods
+        try:
+            if not known:
+                raise ValueError("Unknown method: %s" % method)
+            params = {k: v for k, v in request.items() if k != "method"}
+            response = {"result": self.methods[method](**params)}
+        except (TypeError, ValueError) as e:
+            response = {"error": str(e)}
+
+        # Unknown methods are counted together, to bound the metrics
+        if not known:
+            method = "unknown"
+        with self.lock:
+            self.counts[method] += 1
+            self.errors[method] += int("error" in response)
+            self.latencies[method].append(time.perf_counter() - start)
+        return response
+
+    def call(self, method, **params):
+        """Calls a method like a client, raises ValueError on errors"""
+        response = self.handle(dict(params, method=method))
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def capacity(self, timeslot, accuracy=100):
+        return float(self.controller.predict_capacity(timeslot, accuracy))
+
+    def min_capacity(self, timeslot, accuracy=100):
+        return float(self.controller.predict_min_capacity(timeslot, accuracy))
+
+    def clearing_price(self, timeslot, market="intraday"):
+        return float(self._market(market).clearing_price(timeslot))
+
+    def bid(self, timeslot, price, quantity, market="intraday"):
+        bid = Bid(timeslot, price, quantity)
+        return bool(self._market(market).place_bid(bid))
+
+    def capacities(self, timeslots, accuracy=100):
+        return _list(self.controller.predict_capacities(timeslots, accuracy))
+
+    def min_capacities(self, timeslots, accuracy=100):
+        return _list(self.controller.predict_min_capacities(timeslots, accuracy))
+
+    def clearing_prices(self, timeslots, market="intraday"):
+        return _list(self._market(market).clearing_prices(timeslots))
+
+    def metrics(self):
+        """Number of requests, errors and latencies in ms by method"""
+        with self.lock:
+            methods = {
+                method: dict(
+                    requests=count,
+                    errors=self.errors[method],
+                    **_latency_ms(self.latencies[method])
+                )
+                for method, count in self.counts.items()
+            }
+        return dict(uptime_s=time.time() - self.started, methods=methods)
+
+    def _market(self, market):
+        if market == "intraday":
+            return self.controller.intraday_market
+        elif market == "balancing":
+            return self.controller.balancing_market
+        raise ValueError("Unknown market: %s" % market)
+
+
+def _list(values):
+    """Values as JSON list, with None for NaN"""
+    return [None if math.isnan(v) else v for v in values.tolist()]
+
+
+def _latency_ms(latencies):
+    if not latencies:
+        return dict()
+    ms = np.array(latencies) * 1000
+    return dict(
+        mean_ms=float(ms.mean()),
+        p50_ms=float(np.percentile(ms, 50)),
+        p99_ms=float(np.percentile(ms, 99)),
+        max_ms=float(ms.max()),
+    )
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers JSON lines on a connection until the client closes it"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.service.handle(json.loads(line))
+            except ValueError as e:
+                response = {"error": "Invalid request: %s" % e}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def server(service, address):
+    """Server for a Unix socket path or a 'host:port' address"""
+    host, port = parse_address(address)
+    if port is None:
+        _remove_socket(host)
+        s = _UnixServer(host, _Handler)
+    else:
+        s = _TCPServer((host, port), _Handler)
+    s.service = service
+    return s
+
+
+def serve(service, address):
+    s = server(service, address)
+    logger.info("Serving controller on %s" % address)
+
+    # Clean up the socket when stopped by a service manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        s.serve_forever()
+    finally:
+        s.server_close()
+        if parse_address(address)[1] is None:
+            _remove_socket(address)
+
+
+def _remove_socket(path):
+    """Removes a stale Unix socket, but never another file at the path"""
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise click.ClickException("%s exists and is not a socket." % path)
+    os.remove(path)
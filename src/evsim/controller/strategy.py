@@ -6,6 +6,10 @@ hour = minute * 60
 day = hour * 24
 week = day * 7
 
+# Lead times of the bids for the markets
+BALANCING_LEADTIME = week
+INTRADAY_LEADTIME = 30 * minute
+
 
 def regular(controller, timeslot, risk, accuracy):
     """ Charge all EVs at regular prices"""
@@ -21,13 +25,12 @@ def balancing(controller, timeslot, risk, accuracy):
 
     # NOTE: Bidding for 1 timeslot exactly 1 week ahead, not for whole week
     # 7 days lead time
-    leadtime = week
     return market_strategy(
         controller,
         controller.balancing_market,
         controller.balancing_plan,
         timeslot,
-        leadtime,
+        BALANCING_LEADTIME,
         r,
         acc,
     )
@@ -41,13 +44,12 @@ def intraday(controller, timeslot, risk, accuracy):
     _, acc = accuracy
 
     # 30 minute lead time
-    leadtime = 30 * minute
     return market_strategy(
         controller,
         controller.intraday_market,
         controller.intraday_plan,
         timeslot,
-        leadtime,
+        INTRADAY_LEADTIME,
         r,
         acc,
     )
@@ -62,7 +64,7 @@ def integrated(controller, timeslot, risk, accuracy):
     2. Charge predicted rest from intraday 30-min ahead
 
     """
-    if int(timeslot / 60) % 15 != 0:
+    if not _bidding_period(timeslot, controller.cfg.market_period):
         controller.log("Not a bidding period.")
         return 0
 
@@ -91,13 +93,37 @@ def integrated(controller, timeslot, risk, accuracy):
     return profit
 
 
+def may_bid(strategy, timeslot, market_period=15):
+    """Whether a strategy may bid or change a plan at a timeslot, by the
+    same rules as the strategy itself. Unknown strategies may at every
+    timeslot.
+    """
+    bal = _bidding_period(timeslot + BALANCING_LEADTIME, market_period)
+    intr = _bidding_period(timeslot + INTRADAY_LEADTIME, market_period)
+    if strategy is regular:
+        return False
+    elif strategy is balancing:
+        return bal
+    elif strategy is intraday:
+        return intr
+    elif strategy is integrated:
+        return _bidding_period(timeslot, market_period) and (bal or intr)
+    return True
+
+
+def _bidding_period(t, market_period):
+    """Whether t is the start of a market period, given in minutes"""
+    return int(t / 60) % market_period == 0
+
+
 def market_strategy(controller, market, plan, timeslot, leadtime, risk, accuracy):
     assert 0 <= risk and risk <= 1
 
+    cfg = controller.cfg
     market_period = timeslot + leadtime
     mp_dt = datetime.fromtimestamp(market_period)
 
-    if int(market_period / 60) % 15 != 0:
+    if not _bidding_period(market_period, cfg.market_period):
         controller.log("Not a bidding period.")
         return 0
 
@@ -112,10 +138,9 @@ def market_strategy(controller, market, plan, timeslot, leadtime, risk, accuracy
         controller.warning("Not bidding: %s" % e)
         return 0
 
-    if cp > controller.cfg.industry_tariff:
+    if cp > cfg.industry_tariff:
         controller.log(
-            "The industry tariff is cheaper (%.2f > %.2f)"
-            % (cp, controller.cfg.industry_tariff)
+            "The industry tariff is cheaper (%.2f > %.2f)" % (cp, cfg.industry_tariff)
         )
         return 0
 
@@ -138,25 +163,32 @@ def market_strategy(controller, market, plan, timeslot, leadtime, risk, accuracy
     )
     bid = Bid(market_period, cp, quantity)
     successful = market.place_bid(bid)
+    controller.profile.count("bids")
     if successful:
         controller.log(
-            "Bought %.2f kWh for %.2f EUR/MWh for 15-min timeslot %s"
-            % (bid.quantity * (15 / 60), bid.price, mp_dt)
+            "Bought %.2f kWh for %.2f EUR/MWh for %d-min timeslot %s"
+            % (
+                bid.quantity * (cfg.market_period / 60),
+                bid.price,
+                cfg.market_period,
+                mp_dt,
+            )
         )
     else:
         controller.log("Bid unsuccessful")
         return 0
 
     # Update consumption plan for control periods
-    for t in [0, 5, 10]:
+    for t in range(0, cfg.market_period, cfg.control_period):
         plan.add(bid.marketperiod + (60 * t), bid.quantity)
 
-    profit = _bid_profit(bid, controller.cfg.industry_tariff)
+    profit = _bid_profit(bid, cfg.industry_tariff, cfg.market_period)
     return profit
 
 
-def _bid_profit(bid, industry_tariff):
+def _bid_profit(bid, industry_tariff, market_period=15):
     # Quantity MWh * (cheaper tariff)
-    profit = (bid.quantity * (15 / 60) / 1000) * (industry_tariff - bid.price)
+    energy_mwh = bid.quantity * (market_period / 60) / 1000
+    profit = energy_mwh * (industry_tariff - bid.price)
     profit = round(profit, 2)
     return profit
@@ -5,57 +5,205 @@ import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Column layout of the raw car2go snapshot files
+RAW_COLUMNS = [
+    "name",
+    "vin",
+    "coordinates_lat",
+    "coordinates_lon",
+    "interior",
+    "exterior",
+    "address",
+    "fuel",
+    "engineType",
+    "charging",
+    "timestamp",
+]
+
+# Explicit dtypes of the columns needed for trip detection
+RAW_DTYPES = {
+    "name": object,
+    "coordinates_lat": np.float32,
+    "coordinates_lon": np.float32,
+    "fuel": np.float32,
+    "charging": np.int8,
+    "timestamp": np.int64,
+}
+
+
+# Columns of the trips determined by calculate_trips
+TRIP_COLUMNS = [
+    "EV",
+    "start_time",
+    "start_lat",
+    "start_lon",
+    "start_soc",
+    "end_time",
+    "end_lat",
+    "end_lon",
+    "end_soc",
+    "trip_duration",
+    "end_charging",
+]
+
+
+def shard_snapshots(csv_path, shard_dir, num_shards, chunksize):
+    """Stream a raw car2go file in chunks and partition its rows by EV into
+    on-disk shards. Each shard holds all snapshots of a subset of EVs,
+    so trip detection can run shard by shard.
+    """
+    reader = pd.read_csv(
+        csv_path,
+        header=0,
+        names=RAW_COLUMNS,
+        usecols=list(RAW_DTYPES),
+        dtype=RAW_DTYPES,
+        chunksize=chunksize,
+    )
 
-def determine_trips(df, ev_range, car2go_price, duration_threshold, infer_chargers):
-    """Determine and clean trips"""
+    num_rows = 0
+    for i, chunk in enumerate(reader):
+        chunk = preprocess(chunk)
+        shards = pd.util.hash_pandas_object(chunk["name"], index=False) % num_shards
+        for shard, df_shard in chunk.groupby(shards.values):
+            path = shard_dir / ("%03d" % shard) / ("%06d.pkl" % i)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle(df_shard, path)
+        num_rows += len(chunk)
 
-    if infer_chargers:
-        df_stations = _determine_charging_stations(df)
+    logger.info("Partitioned %d snapshots of %s." % (num_rows, csv_path.name))
+    return num_rows
+
+
+def read_shards(shard_dir):
+    """Yield the snapshots of every shard, keeping the order they were written"""
+    for shard in sorted(p for p in shard_dir.iterdir() if p.is_dir()):
+        parts = sorted(shard.glob("*.pkl"))
+        if parts:
+            yield pd.concat([pd.read_pickle(p) for p in parts])
+
+
+def compress(df):
+    """Collapse consecutive snapshots of an EV parked at the same location into
+    dwell intervals. Keeps first and last timestamp and fuel level, the fuel
+    range and whether the EV has been charging at any time of the dwell.
+    """
+    # Group snapshots by EV, keeping their chronological order
+    df = df.sort_values("name", kind="mergesort")
+
+    name = df["name"].values
+    lat = df["coordinates_lat"].values
+    lon = df["coordinates_lon"].values
+    moved = np.ones(len(df), dtype=bool)
+    moved[1:] = (name[1:] != name[:-1]) | (lat[1:] != lat[:-1]) | (lon[1:] != lon[:-1])
+
+    first = np.flatnonzero(moved)
+    last = np.append(first[1:] - 1, len(df) - 1)
+
+    timestamp = df["timestamp"].values
+    fuel = df["fuel"].values
+    charging = df["charging"].values
+    df_dwells = pd.DataFrame(
+        {
+            "name": name[first],
+            "coordinates_lat": lat[first],
+            "coordinates_lon": lon[first],
+            "timestamp": timestamp[first],
+            "timestamp_last": timestamp[last],
+            "fuel": fuel[first],
+            "fuel_last": fuel[last],
+            "fuel_min": np.minimum.reduceat(fuel, first),
+            "fuel_max": np.maximum.reduceat(fuel, first),
+            "charging": charging[first],
+            "charging_any": np.maximum.reduceat(charging, first),
+        }
+    )
+    logger.info("Compressed %d snapshots to %d dwells." % (len(df), len(df_dwells)))
+    return df_dwells
 
+
+def partition_trips(shards, states):
+    """Determine the trips of one raw file from its shards of dwells.
+
+    Continues from the boundary state of each EV at the end of the previous
+    file, so trips spanning a file boundary are stitched correctly. Returns
+    the closed trips and the updated boundary states.
+    """
     trips = list()
-    cars = df["name"].unique()
-    logger.info("Determining trips of %d cars..." % len(cars))
-    for car in cars:
-        ev_trips = calculate_trips(df[df["name"] == car], ev_range)
-        trips.append(ev_trips)
+    for df in shards:
+        cars = df.groupby("name", sort=False)
+        logger.info("Determining trips of %d cars..." % cars.ngroups)
+        for car, df_car in cars:
+            ev_trips, states[car] = calculate_trips(df_car, states.get(car))
+            trips.extend(ev_trips)
+
+    return pd.DataFrame(trips, columns=TRIP_COLUMNS), states
+
+
+def open_trips(states):
+    """Last trip of every EV, which has not been closed by a later file yet"""
+    trips = [trip for _, _, trip in states.values() if trip is not None]
+    return pd.DataFrame(trips, columns=TRIP_COLUMNS)
+
+
+def determine_trips(
+    df_trips, df_stations, ev_range, car2go_price, duration_threshold, infer_chargers
+):
+    """Determine and clean trips from the union of all trip partitions"""
 
-    df_trips = pd.concat(trips)
     df_trips = df_trips.sort_values("start_time").reset_index().drop("index", axis=1)
     logger.info(
         "Found %d trips, %d ended at a charging station."
         % (len(df_trips), len(df_trips[df_trips["end_charging"] == 1]))
     )
 
+    df_trips.insert(
+        len(df_trips.columns) - 1,
+        "trip_distance",
+        _trip_distance(df_trips["start_soc"] - df_trips["end_soc"], ev_range),
+    )
     df_trips = _calculate_price(df_trips, car2go_price)
 
     if infer_chargers:
+        df_stations = (
+            df_stations.groupby(["coordinates_lat", "coordinates_lon"])["charging"]
+            .max()
+            .reset_index()
+        )
+        logger.info("Determined %d charging stations in total" % len(df_stations))
         df_trips = _add_charging_stations(df_trips, df_stations)
 
     df_trips = _clean_trips(df_trips, duration_threshold)
     df_trips = df_trips.apply(pd.to_numeric, errors="ignore", downcast="integer")
-    return df_trips
+    return compact_trips(df_trips)
 
 
-def drop_unused(df):
-    """Drop unused columns, round values, and save DataFrame as pickle"""
-    df.columns = [
-        "name",
-        "vin",
-        "coordinates_lat",
-        "coordinates_lon",
-        "interior",
-        "exterior",
-        "address",
-        "fuel",
-        "engineType",
-        "charging",
-        "timestamp",
-    ]
-    df.drop(
-        ["vin", "interior", "exterior", "address", "engineType"], axis=1, inplace=True
-    )
-    df = df.apply(pd.to_numeric, errors="ignore", downcast="float")
-    return df
+def compact_trips(df):
+    """Intern EV names into a categorical with a dense integer id and store
+    timestamps (seconds since epoch) and floats in compact dtypes.
+    """
+    df["EV"] = df["EV"].astype("category").cat.remove_unused_categories()
+    df["ev_id"] = df["EV"].cat.codes.astype(np.int32)
+
+    dtypes = {
+        "start_time": np.int32,
+        "end_time": np.int32,
+        "start_lat": np.float32,
+        "start_lon": np.float32,
+        "end_lat": np.float32,
+        "end_lon": np.float32,
+        "start_soc": np.float32,
+        "end_soc": np.float32,
+        "trip_distance": np.float32,
+        "trip_price": np.float32,
+        "end_charging": np.int8,
+    }
+    return df.astype(dtypes)
+
+
+def determine_charging_stations(shards):
+    """Find charging stations of one raw file from its shards of dwells"""
+    return pd.concat([_determine_charging_stations(df) for df in shards])
 
 
 def preprocess(df):
@@ -94,8 +242,10 @@ def _add_charging_stations(df_trips, df_stations):
 def _determine_charging_stations(df):
     """Find charging stations where EV has been charged once (charging==1)."""
 
-    df_stations = df.groupby(["coordinates_lat", "coordinates_lon"])["charging"].max()
-    df_stations = df_stations[df_stations == 1]
+    df_stations = df.groupby(["coordinates_lat", "coordinates_lon"])[
+        "charging_any"
+    ].max()
+    df_stations = df_stations[df_stations == 1].rename("charging")
     df_stations = df_stations.reset_index()
     logger.info("Determined %d charging stations in the dataset" % len(df_stations))
     return df_stations
@@ -196,10 +346,10 @@ def _avg_soc(evs):
 
 def _start_trip(evs, fleet, rent, charging, vpp):
     # Update fleet SoC
-    fleet.update(dict(zip(evs.EV, evs.start_soc)))
+    fleet.update(dict(zip(evs.ev_id, evs.start_soc)))
 
     # Starting EVs are note available for rent, charge, vpp
-    for ev in set(evs.EV):
+    for ev in set(evs.ev_id):
         rent.pop(ev, None)
         charging.pop(ev, None)
         vpp.pop(ev, None)
@@ -209,18 +359,18 @@ def _start_trip(evs, fleet, rent, charging, vpp):
 
 def _end_trip(evs, fleet, rent, charging, vpp, charging_step):
     # Update fleet SoC
-    fleet.update(dict(zip(evs.EV, evs.end_soc)))
+    fleet.update(dict(zip(evs.ev_id, evs.end_soc)))
 
     # Make EVs available for rent
-    rent.update(dict(zip(evs.EV, evs.end_soc)))
+    rent.update(dict(zip(evs.ev_id, evs.end_soc)))
 
     # Add charging EVs
     charging_evs = evs.loc[evs["end_charging"] == 1]
-    charging.update(dict(zip(charging_evs.EV, evs.end_soc)))
+    charging.update(dict(zip(charging_evs.ev_id, evs.end_soc)))
 
     # EVs are only eligible for VPP when they have enough available battery capacity
     vpp_evs = charging_evs.loc[charging_evs["end_soc"] <= (100 - charging_step)]
-    vpp.update(dict(zip(vpp_evs.EV, vpp_evs.end_soc)))
+    vpp.update(dict(zip(vpp_evs.ev_id, vpp_evs.end_soc)))
 
     return (fleet, rent, charging, vpp)
 
@@ -246,14 +396,24 @@ def _charging_step(battery_capacity, charging_speed, control_period):
     return soc_per_control_period
 
 
-def calculate_trips(df_car, ev_range):
+def calculate_trips(df_car, state=None):
+    """Determine the trips of an EV from its dwells.
+
+    The state carries the EV's last location, charging flag and last trip
+    over from the previous raw file. The last trip stays open, since it may
+    still be marked to end at a charging station when the EV leaves again.
+    """
     trips = list()
-    charging = False
-    prev_row = df_car.iloc[0]
+    location, charging = None, False
+    if state is not None:
+        location, charging, open_trip = state
+        if open_trip is not None:
+            trips.append(open_trip)
+
     for row in df_car.itertuples():
         # New trip detected when location changes.
-        if (row.coordinates_lat != prev_row.coordinates_lat) | (
-            row.coordinates_lon != prev_row.coordinates_lon
+        if location is not None and (
+            (row.coordinates_lat != location[0]) | (row.coordinates_lon != location[1])
         ):
             # Last location was at a charging station
             # Add charging info to previous trip.
@@ -263,55 +423,42 @@ def calculate_trips(df_car, ev_range):
                 trips.append(previous_trip)
                 charging = False
 
+            lat, lon, timestamp, fuel = location
             trip = [
-                prev_row.name,
-                prev_row.timestamp,
-                prev_row.coordinates_lat,
-                prev_row.coordinates_lon,
-                prev_row.fuel,
+                row.name,
+                timestamp,
+                lat,
+                lon,
+                fuel,
                 row.timestamp,
                 row.coordinates_lat,
                 row.coordinates_lon,
                 row.fuel,
-                int((row.timestamp - prev_row.timestamp) / 60),
-                _trip_distance(prev_row.fuel - row.fuel, ev_range),
+                int((row.timestamp - timestamp) / 60),
                 row.charging,
             ]
             trips.append(trip)
 
         # Charging at current location
-        if row.charging == 1:
+        if row.charging_any == 1:
             charging = True
 
-        prev_row = row
+        location = (
+            row.coordinates_lat,
+            row.coordinates_lon,
+            row.timestamp_last,
+            row.fuel_last,
+        )
 
-    return pd.DataFrame(
-        trips,
-        columns=[
-            "EV",
-            "start_time",
-            "start_lat",
-            "start_lon",
-            "start_soc",
-            "end_time",
-            "end_lat",
-            "end_lon",
-            "end_soc",
-            "trip_duration",
-            "trip_distance",
-            "end_charging",
-        ],
-    )
+    open_trip = trips.pop() if trips else None
+    return trips, (location, charging, open_trip)
 
 
 # TODO: When negative charge, calculate distance according to Kahlen
 # Driven distance: (42%-20%) * 70 miles = 15.4 miles
 def _trip_distance(trip_charge, ev_range):
     # EV has been charged on the trip. Not possible to infer distance
-    if trip_charge < 0:
-        return np.nan
-
-    return (trip_charge / 100) * ev_range
+    return ((trip_charge / 100) * ev_range).where(trip_charge >= 0)
 
 
 def _clean_trips(df, duration_threshold):
@@ -6,33 +6,6 @@ search_dirs = [
     Path("../data"),
     Path(__file__).resolve().parents[3] / "data",
 ]
-data_dir = None
-for p in search_dirs:
-    if p.is_dir():
-        data_dir = p
-        break
-
-# base dirs
-raw_data_dir = data_dir / "raw"
-processed_data_dir = data_dir / "processed"
-car2go_dir = raw_data_dir / "car2go"
-balancing_dir = raw_data_dir / "balancing"
-intraday_dir = raw_data_dir / "intraday"
-
-# raw file paths
-activated_balancing = balancing_dir / "activated_balancing_2016_2017.csv"
-tender_results = balancing_dir / "tender_results_2016_2017.csv"
-procom_trades = intraday_dir / "procom_data.csv"
-
-# processed files paths
-trips = processed_data_dir / "trips.pkl"
-capacity = processed_data_dir / "capacity.pkl"
-control_reserve = processed_data_dir / "activated_control_reserve.csv"
-processed_tender_results = processed_data_dir / "tender_results.csv"
-balancing_prices = processed_data_dir / "balancing_prices.csv"
-intraday_prices = processed_data_dir / "intraday_prices.csv"
-# simulation result file paths
-simulation_baseline = processed_data_dir / "sim-baseline.csv"
 
 # car2go Files
 car2go = [
@@ -43,3 +16,58 @@ car2go = [
     # "stuttgart.2017.05.01-2017.10.31.csv",
     # "stuttgart.2017.11.01-2018.01.31.csv",
 ]
+
+
+def _resolve():
+    """Searches the data dir and returns all file paths by name"""
+    data_dir = None
+    for p in search_dirs:
+        if p.is_dir():
+            data_dir = p
+            break
+    if data_dir is None:
+        raise FileNotFoundError(
+            "No data dir found in %s" % ", ".join(str(p) for p in search_dirs)
+        )
+
+    # base dirs
+    raw_data_dir = data_dir / "raw"
+    processed_data_dir = data_dir / "processed"
+    car2go_dir = raw_data_dir / "car2go"
+    balancing_dir = raw_data_dir / "balancing"
+    intraday_dir = raw_data_dir / "intraday"
+
+    return dict(
+        data_dir=data_dir,
+        raw_data_dir=raw_data_dir,
+        processed_data_dir=processed_data_dir,
+        car2go_dir=car2go_dir,
+        balancing_dir=balancing_dir,
+        intraday_dir=intraday_dir,
+        # raw file paths
+        activated_balancing=balancing_dir / "activated_balancing_2016_2017.csv",
+        tender_results=balancing_dir / "tender_results_2016_2017.csv",
+        procom_trades=intraday_dir / "procom_data.csv",
+        # processed files paths
+        trips=processed_data_dir / "trips.pkl",
+        car2go_partitions=processed_data_dir / "car2go",
+        synthetic_trips=processed_data_dir / "synthetic",
+        capacity=processed_data_dir / "capacity.pkl",
+        control_reserve=processed_data_dir / "activated_control_reserve.csv",
+        processed_tender_results=processed_data_dir / "tender_results.csv",
+        balancing_prices=processed_data_dir / "balancing_prices.csv",
+        intraday_prices=processed_data_dir / "intraday_prices.csv",
+        # simulation result file paths
+        simulation_baseline=processed_data_dir / "sim-baseline.csv",
+    )
+
+
+# NOTE: The data dir is searched on first access of a path, not on import
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    paths = _resolve()
+    if name not in paths:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals().update(paths)
+    return paths[name]
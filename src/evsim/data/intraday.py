@@ -1,26 +1,66 @@
 import logging
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Columns of the procom trades needed for the clearing prices
+PROCOM_DTYPES = {
+    "delivery_date": object,
+    "product": object,
+    "product_time": object,
+    "unit_price": np.float64,
+}
 
-def calculate_clearing_prices(df):
-    time = df["product_time"].str.split("Q", expand=True)
-    df["delivery_date"] = pd.to_datetime(
-        df["delivery_date"].astype(str)
-        + " "
-        + time[0]
-        + ":"
-        + ((time[1].astype(int) - 1) * 15).astype(str)
+
+def stream_clearing_prices(path, chunksize):
+    """Calculate clearing prices of quarter-hour products chunk by chunk.
+    Only the needed columns are parsed and trades of other products are
+    dropped right after reading, keeping the running minimum per period.
+    """
+    reader = pd.read_csv(
+        path,
+        sep=",",
+        index_col=False,
+        usecols=list(PROCOM_DTYPES),
+        dtype=PROCOM_DTYPES,
+        chunksize=chunksize,
     )
 
-    # Clearing price is the lowest conducted trade. Bidding above the clearing price
-    # will always be sucessful
-    df = df.groupby("delivery_date").min().reset_index()
+    prices = None
+    num_trades = 0
+    for chunk in reader:
+        chunk = chunk.loc[chunk["product"] == "Q"]
+        num_trades += len(chunk)
+        if chunk.empty:
+            continue
 
-    # Transform to EUR/MWh
-    df.loc[:, "unit_price"] = df["unit_price"] / 100
+        # Clearing price is the lowest conducted trade. Bidding above the clearing
+        # price will always be sucessful
+        chunk_prices = chunk["unit_price"].groupby(_delivery_period(chunk)).min()
+        if prices is None:
+            prices = chunk_prices
+        else:
+            prices = pd.concat([prices, chunk_prices]).groupby(level=0).min()
+
+    logger.info("Found %d quarter-hour trades in %s." % (num_trades, path.name))
+    if prices is None:
+        return pd.DataFrame(
+            {
+                "product_time": pd.Series(dtype="datetime64[ns]"),
+                "clearing_price_mwh": pd.Series(dtype=np.float64),
+            }
+        )
 
-    df = df.loc[:, ["delivery_date", "unit_price"]]
+    # Transform to EUR/MWh
+    df = (prices / 100).sort_index().reset_index()
     df.columns = ["product_time", "clearing_price_mwh"]
     return df
+
+
+def _delivery_period(df):
+    """Start of the delivery period of a quarter-hour product, e.g. '08Q2'"""
+    time = df["product_time"].str.split("Q", expand=True).astype(int)
+    minutes = time[0] * 60 + (time[1] - 1) * 15
+    date = pd.to_datetime(df["delivery_date"], dayfirst=True, cache=True)
+    return date + pd.to_timedelta(minutes, unit="m")
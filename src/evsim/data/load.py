@@ -1,7 +1,9 @@
+import json
 import logging
 import pandas as pd
+import shutil
 
-from evsim.data import balancing, car2go, files, intraday
+from evsim.data import balancing, car2go, files, intraday, synthetic
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +16,13 @@ EV_RANGE = 160
 CAR2GO_PRICE = 24  # 24 cent/km
 DURATION_THRESHOLD = 60 * 24 * 2  # 2 Days in seconds
 
+# Streaming ingestion of raw car2go files
+CAR2GO_SHARDS = 32  # Peak memory is bound by the size of one shard
+CAR2GO_CHUNKSIZE = 10 ** 6  # Rows read at once from a raw file
+
+# Streaming of intraday trades
+PROCOM_CHUNKSIZE = 10 ** 6
+
 
 def rebuild(charging_speed=CHARGING_SPEED, ev_capacity=EV_CAPACITY, ev_range=EV_RANGE):
     car2go_trips(ev_range, rebuild=True)
@@ -39,27 +48,31 @@ def car2go_trips(
 ):
     """Loads processed trip data into a dataframe, process again if needed"""
 
-    if rebuild is True:
-        files.processed_data_dir.mkdir(parents=True, exist_ok=True)
-        logger.info("Preprocessing and dropping columns.")
-        for f in files.car2go:
-            logger.info("Converting to pickle: %s..." % f)
-            df = pd.read_csv(files.car2go_dir / f)
-            df = car2go.drop_unused(df)
-            pd.to_pickle(df, _change_ext(files.car2go_dir / f, ".pkl"))
-
     # Return early if processed files is present
     if rebuild is True or not files.trips.is_file():
-        df_list = []
-        for f in files.car2go:
-            pkl_path = _change_ext(files.car2go_dir / f, ".pkl")
-            logger.info("Reading %s..." % pkl_path.name)
-            df = pd.read_pickle(pkl_path)
-            df_list.append(df)
-
-        df = car2go.preprocess(pd.concat(df_list))
+        files.processed_data_dir.mkdir(parents=True, exist_ok=True)
+
+        # Only raw files that are new or changed are processed again
+        partitions = _update_car2go_partitions()
+        states = pd.read_pickle(partitions[-1] / "state.pkl")
+        df_trips = pd.concat(
+            [pd.read_pickle(p / "trips.pkl") for p in partitions]
+            + [car2go.open_trips(states)]
+        )
+
+        df_stations = None
+        if infer_chargers:
+            df_stations = pd.concat(
+                [pd.read_pickle(p / "stations.pkl") for p in partitions]
+            )
+
         df_trips = car2go.determine_trips(
-            df, ev_range, car2go_price, duration_threshold, infer_chargers
+            df_trips,
+            df_stations,
+            ev_range,
+            car2go_price,
+            duration_threshold,
+            infer_chargers,
         )
         df_trips = (
             df_trips.sort_values(["start_time"]).reset_index().drop(["index"], axis=1)
@@ -69,7 +82,41 @@ def car2go_trips(
         pd.to_pickle(df_trips, files.trips)
         logger.info("Wrote all processed trips files to %s" % files.trips)
 
-    return pd.read_pickle(files.trips)
+    # Trips processed by earlier versions are compacted on the fly
+    return car2go.compact_trips(pd.read_pickle(files.trips))
+
+
+def synthetic_trips(name, nb_evs=None, days=None, start_time=None, seed=None):
+    """Loads synthetic trips into a dataframe. Generates them with the
+    distributions of the processed car2go trips, if a fleet size is given.
+    """
+    path = files.synthetic_trips / ("%s.pkl" % name)
+
+    if nb_evs is not None:
+        df_trips = car2go_trips()
+        model = synthetic.fit(df_trips)
+        if start_time is None:
+            start_time = int(df_trips["start_time"].min())
+        df = synthetic.generate(
+            model,
+            nb_evs,
+            start_time,
+            start_time + days * 24 * 60 * 60,
+            seed,
+            CHARGING_SPEED,
+            EV_CAPACITY,
+        )
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle(df, path)
+        logger.info("Wrote synthetic trips to %s" % path)
+        return df
+
+    if not path.is_file():
+        raise FileNotFoundError(
+            "%s not found. Generate it with evsim build synthetic first." % path
+        )
+    return pd.read_pickle(path)
 
 
 def car2go_capacity(
@@ -99,20 +146,7 @@ def intraday_prices(rebuild=False):
 
     if rebuild is True or not files.intraday_prices.is_file():
         logger.info("Processing %s..." % files.procom_trades)
-        df = pd.read_csv(
-            files.procom_trades,
-            sep=",",
-            index_col=False,
-            dayfirst=True,
-            parse_dates=[1, 9],
-            infer_datetime_format=True,
-        )
-        df[df["product"] == "H"].to_pickle(files.processed_data_dir / "procom_H.pkl")
-        df[df["product"] == "Q"].to_pickle(files.processed_data_dir / "procom_Q.pkl")
-        df[df["product"] == "B"].to_pickle(files.processed_data_dir / "procom_B.pkl")
-
-        df_q = pd.read_pickle(files.processed_data_dir / "procom_Q.pkl")
-        df_q = intraday.calculate_clearing_prices(df_q)
+        df_q = intraday.stream_clearing_prices(files.procom_trades, PROCOM_CHUNKSIZE)
         df_q.to_csv(files.intraday_prices, index=False)
         logger.info(
             "Wrote calculated intraday clearing prices to %s" % files.intraday_prices
@@ -175,5 +209,86 @@ def balancing_prices(rebuild=False):
     )
 
 
+def _update_car2go_partitions():
+    """Process every raw car2go file into its own trip partition.
+
+    A partition is reused as long as its raw file and all raw files before it
+    are unchanged, since it continues from the EV states of the previous one.
+    Appending a new raw file therefore only processes that file.
+    """
+    missing = [f for f in files.car2go if not (files.car2go_dir / f).is_file()]
+    if not files.car2go or missing:
+        raise FileNotFoundError(
+            "Raw car2go files not found in %s: %s"
+            % (files.car2go_dir, ", ".join(missing) or "none are listed")
+        )
+
+    partitions = list()
+    manifest = None
+    for f in files.car2go:
+        stat = (files.car2go_dir / f).stat()
+        raw = [f, stat.st_size, stat.st_mtime]
+        manifest = [raw, manifest]
+
+        partition = files.car2go_partitions / _change_ext(files.car2go_dir / f, "").name
+        if manifest != _read_manifest(partition / "manifest.json"):
+            states = dict()
+            if partitions:
+                states = pd.read_pickle(partitions[-1] / "state.pkl")
+            _build_car2go_partition(partition, raw, manifest, states)
+        else:
+            logger.info("Reusing trip partition of %s." % f)
+
+        partitions.append(partition)
+
+    return partitions
+
+
+def _build_car2go_partition(partition, raw, manifest, states):
+    # Compressed dwells are reused as long as the raw file is unchanged
+    dwells = partition / "dwells"
+    if raw != _read_manifest(dwells / "manifest.json"):
+        shutil.rmtree(partition, ignore_errors=True)
+        logger.info("Partitioning %s into shards..." % raw[0])
+        car2go.shard_snapshots(
+            files.car2go_dir / raw[0],
+            partition / "shards",
+            CAR2GO_SHARDS,
+            CAR2GO_CHUNKSIZE,
+        )
+
+        dwells.mkdir(parents=True)
+        for i, df in enumerate(car2go.read_shards(partition / "shards")):
+            pd.to_pickle(car2go.compress(df), dwells / ("%03d.pkl" % i))
+        shutil.rmtree(partition / "shards")
+        _write_manifest(dwells / "manifest.json", raw)
+
+    df_trips, states = car2go.partition_trips(_read_dwells(dwells), states)
+    df_stations = car2go.determine_charging_stations(_read_dwells(dwells))
+
+    pd.to_pickle(df_trips, partition / "trips.pkl")
+    pd.to_pickle(df_stations, partition / "stations.pkl")
+    pd.to_pickle(states, partition / "state.pkl")
+    _write_manifest(partition / "manifest.json", manifest)
+    logger.info("Wrote %d trips of %s to %s" % (len(df_trips), raw[0], partition))
+
+
+def _read_dwells(path):
+    for p in sorted(path.glob("*.pkl")):
+        yield pd.read_pickle(p)
+
+
+def _read_manifest(path):
+    if not path.is_file():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(path, manifest):
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
 def _change_ext(path, ext):
     return path.parent / (path.stem + ext)
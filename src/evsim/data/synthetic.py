@@ -0,0 +1,178 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from evsim.data.car2go import compact_trips, _charging_step
+
+logger = logging.getLogger(__name__)
+
+day = 24 * 60 * 60
+week = 7 * day
+timeslot = 5 * 60
+
+# Trip features, which are sampled jointly from the real trips
+FEATURES = [
+    "trip_duration",
+    "soc_delta",
+    "end_charging",
+    "trip_distance",
+    "trip_price",
+    "start_lat",
+    "start_lon",
+    "end_lat",
+    "end_lon",
+]
+
+# Column order of processed trips
+COLUMNS = [
+    "EV",
+    "start_time",
+    "start_lat",
+    "start_lon",
+    "start_soc",
+    "end_time",
+    "end_lat",
+    "end_lon",
+    "end_soc",
+    "trip_duration",
+    "trip_distance",
+    "end_charging",
+    "trip_price",
+]
+
+
+def fit(df):
+    """Fits the distributions of a synthetic fleet to processed trips:
+
+    - Trip starts per EV for every 5 min timeslot of the week
+    - Duration, SoC delta, end at charger, price and location of trips,
+      sampled jointly to keep their correlation
+    - SoC of the EVs at their first trip
+    """
+    start_times = df["start_time"].values.astype(np.int64)
+    nb_evs = df["ev_id"].nunique()
+
+    # Trips per EV and timeslot of the week, averaged over the weeks observed
+    slots = np.arange(
+        start_times.min() - start_times.min() % timeslot,
+        df["end_time"].max() + 1,
+        timeslot,
+    )
+    observed = np.bincount(_week_slot(slots), minlength=week // timeslot)
+    trips = np.bincount(_week_slot(start_times), minlength=week // timeslot)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = trips / observed / nb_evs
+
+    # Timeslots of weekdays not in data get the mean of the same time of day
+    rate = rate.reshape(7, -1)
+    rate = np.where(np.isnan(rate), np.nanmean(rate, axis=0), rate)
+    rate = np.nan_to_num(rate.ravel())
+
+    features = df.assign(soc_delta=df["start_soc"] - df["end_soc"])[FEATURES]
+    first = df.sort_values("start_time").drop_duplicates("ev_id")
+    logger.info(
+        "Fitted synthetic fleet to %d trips of %d EVs, %.2f trips per EV and day."
+        % (len(df), nb_evs, rate.mean() * (day // timeslot))
+    )
+    return {
+        "rate": rate,
+        "trips": features.reset_index(drop=True),
+        "start_soc": first["start_soc"].values,
+    }
+
+
+def generate(
+    model, nb_evs, start_time, end_time, seed=None, charging_speed=3.6, ev_capacity=17.6
+):
+    """Generates trips of a synthetic fleet of the given size, which start
+    in 5 min timeslots from start to end time (POSIX timestamps).
+
+    Trips of an EV never overlap. The SoC of an EV continues from trip to
+    trip, and increases while parked at a charger.
+    """
+    rng = np.random.RandomState(seed)
+    slots = np.arange(start_time - start_time % timeslot, end_time, timeslot)
+
+    # Trips that overlap a trip of the same EV are dropped, so more trips
+    # are drawn to keep the fitted rate
+    trips = _draw(rng, model, nb_evs, slots, 1)
+    expected = model["rate"][_week_slot(slots)].sum() * nb_evs
+    if len(trips["start_time"]) > 0:
+        trips = _draw(rng, model, nb_evs, slots, expected / len(trips["start_time"]))
+
+    _chain_soc(rng, model, trips, _charging_step(ev_capacity, charging_speed, 5))
+
+    df = pd.DataFrame(
+        {
+            "EV": pd.Categorical.from_codes(
+                trips["ev"], ["SYN-%06d" % i for i in range(nb_evs)]
+            ),
+            **{c: trips[c] for c in COLUMNS[1:]},
+        },
+        columns=COLUMNS,
+    )
+    df["trip_duration"] = df["trip_duration"].astype(np.int16)
+    logger.info("Generated %d trips of %d synthetic EVs." % (len(df), nb_evs))
+    return compact_trips(df)
+
+
+def _draw(rng, model, nb_evs, slots, boost):
+    """Draws trips in every timeslot and drops overlapping trips of an EV"""
+    counts = rng.poisson(model["rate"][_week_slot(slots)] * nb_evs * boost)
+    start_time = np.repeat(slots, counts)
+    ev = rng.randint(nb_evs, size=len(start_time))
+    sample = model["trips"].iloc[rng.randint(len(model["trips"]), size=len(ev))]
+
+    order = np.lexsort((start_time, ev))
+    trips = {c: sample[c].values[order] for c in FEATURES}
+    trips["ev"] = ev[order]
+    trips["start_time"] = start_time[order]
+    trips["trip_duration"] = trips["trip_duration"].astype(np.int64)
+    trips["end_time"] = trips["start_time"] + trips["trip_duration"] * 60
+
+    # Drop the first overlapping trip of a run, until no trips overlap
+    while True:
+        overlap = np.zeros(len(trips["ev"]), dtype=bool)
+        overlap[1:] = (trips["ev"][1:] == trips["ev"][:-1]) & (
+            trips["start_time"][1:] < trips["end_time"][:-1]
+        )
+        if not overlap.any():
+            break
+        drop = overlap.copy()
+        drop[1:] &= ~overlap[:-1]
+        trips = {c: v[~drop] for c, v in trips.items()}
+
+    return trips
+
+
+def _chain_soc(rng, model, trips, charging_step):
+    """Sets the SoC at start and end of the trips, EV by EV in parallel"""
+    n = len(trips["ev"])
+    first = np.ones(n, dtype=bool)
+    first[1:] = trips["ev"][1:] != trips["ev"][:-1]
+    rank = np.arange(n) - np.maximum.accumulate(np.where(first, np.arange(n), 0))
+
+    start_soc = np.zeros(n)
+    end_soc = np.zeros(n)
+    start_soc[first] = rng.choice(model["start_soc"], size=first.sum())
+
+    by_rank = np.argsort(rank, kind="stable")
+    bounds = np.cumsum(np.bincount(rank)) if n else []
+    lo = 0
+    for r, hi in enumerate(bounds):
+        rows = by_rank[lo:hi]
+        lo = hi
+        if r > 0:
+            prev = rows - 1
+            parked = (trips["start_time"][rows] - trips["end_time"][prev]) / timeslot
+            charged = trips["end_charging"][prev] * parked * charging_step
+            start_soc[rows] = np.minimum(100, end_soc[prev] + charged)
+        end_soc[rows] = np.clip(start_soc[rows] - trips["soc_delta"][rows], 0, 100)
+
+    trips["start_soc"] = start_soc
+    trips["end_soc"] = end_soc
+
+
+def _week_slot(timestamps):
+    """Timeslot of the week, starting Monday 00:00 UTC"""
+    return ((np.asarray(timestamps) + 3 * day) % week) // timeslot
@@ -4,17 +4,33 @@ import simpy
 
 
 class EV:
-    def __init__(self, env, vpp, name, soc, battery_capacity, charging_speed):
+    def __init__(
+        self,
+        env,
+        vpp,
+        ev_id,
+        name,
+        soc,
+        battery_capacity,
+        charging_speed,
+        control_period=5,
+    ):
         self.logger = logging.getLogger(__name__)
 
         # Battery capacity in percent
         self.battery = simpy.Container(env, init=soc, capacity=100)
         self.env = env
+        self.id = ev_id
         self.name = name
         self.vpp = vpp
         self.action = None
 
-        self.charging_step = self._charging_step(battery_capacity, charging_speed, 5)
+        # Trip in progress, kept to checkpoint the simulation
+        self.trip = None
+
+        self.charging_step = self._charging_step(
+            battery_capacity, charging_speed, control_period
+        )
 
         self.available = True
         self.charging = False
@@ -52,6 +68,8 @@ class EV:
         increment = min(self.charging_step, self.battery.capacity - self.battery.level)
         if increment > 0:
             self.battery.put(increment)
+            if self.vpp.contains(self):
+                self.vpp.soc_sum += increment
         self.log("Charged battery for %.2f%%." % increment)
 
         # Remove EV after from VPP when battery too full
@@ -114,7 +132,24 @@ class EV:
         # NOTE: Arrive one second early, to be able to start again
         self.available = False
         self.charging = False
-        yield self.env.timeout((duration * 60) - 1)  # seconds
+        arrival = self.env.now + (duration * 60) - 1  # seconds
+        self.trip = (rental, arrival, duration, trip_charge, end_charger, trip_price)
+        yield self.env.timeout(arrival - self.env.now)
+        yield from self._arrive(
+            rental, duration, trip_charge, end_charger, trip_price, account
+        )
+
+    def resume(self, account):
+        """Continues the trip in progress, e.g. of a restored checkpoint"""
+        rental, arrival, duration, trip_charge, end_charger, trip_price = self.trip
+        self.log("Resuming trip %d." % rental)
+        yield self.env.timeout(arrival - self.env.now)
+        yield from self._arrive(
+            rental, duration, trip_charge, end_charger, trip_price, account
+        )
+
+    def _arrive(self, rental, duration, trip_charge, end_charger, trip_price, account):
+        self.trip = None
         account.rental(trip_price)
         self.available = True
 
@@ -13,6 +13,9 @@ class VPP:
         self.evs = dict()
         self.commited_capacity = 0
 
+        # Running sum of the SoC of all EVs in the VPP
+        self.soc_sum = 0
+
     def log(self, message):
         self.logger.info(
             "[%s] - %s(%.1fkW/%.1fkW) %s"
@@ -36,8 +39,9 @@ class VPP:
         return s
 
     def add(self, ev):
-        if ev.name not in self.evs:
-            self.evs[ev.name] = ev
+        if ev.id not in self.evs:
+            self.evs[ev.id] = ev
+            self.soc_sum += ev.battery.level
             self.log("Adding EV '%s' to VPP." % ev.name)
             self.log_EVs()
         else:
@@ -49,18 +53,27 @@ class VPP:
         else:
             return 0
 
+    def mean_soc(self):
+        """Mean SoC of the VPP from the running sum, in constant time"""
+        if len(self.evs) > 0:
+            return self.soc_sum / len(self.evs)
+        else:
+            return 0
+
     def capacity(self):
         return len(self.evs) * self.charging_power
 
     def contains(self, ev):
-        if ev.name in self.evs:
+        if ev.id in self.evs:
             return True
 
         return False
 
     def remove(self, ev):
-        if ev.name in self.evs:
-            del self.evs[ev.name]
+        if ev.id in self.evs:
+            del self.evs[ev.id]
+            # NOTE: Reset when empty, to not accumulate rounding errors
+            self.soc_sum = self.soc_sum - ev.battery.level if self.evs else 0
             self.log("Removed EV %s from VPP." % ev.name)
         else:
             raise ValueError("%s was not allocated to VPP." % ev.name)
@@ -1,2 +1,9 @@
 # flake8: noqa
 from evsim.envs.fleet_env import FleetEnv
+from evsim.envs.vec_env import VecFleetEnv
+from evsim.envs.dataset import Dataset
+from evsim.envs.observation import ObservationBuilder
+
+from gym.envs.registration import register
+
+register(id="evsim-v0", entry_point="evsim.envs:FleetEnv")
@@ -0,0 +1,185 @@
+import json
+import logging
+from pathlib import Path
+import numpy as np
+
+from evsim.envs.fleet_env import FleetEnv
+from evsim.envs.vec_env import VecFleetEnv
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ["obs", "action", "reward", "next_obs", "done"]
+
+
+def uniform_policy(nb_actions, seed=None):
+    """Behaviour policy picking flat actions uniformly at random"""
+    rng = np.random.RandomState(seed)
+
+    def policy(obs):
+        return rng.randint(nb_actions, size=len(obs))
+
+    return policy
+
+
+def constant_policy(action):
+    """Behaviour policy always bidding with the same risk factors"""
+
+    def policy(obs):
+        return np.full(len(obs), action)
+
+    return policy
+
+
+def record(
+    path, policy, steps, num_envs=1, env_kwargs=None, chunk_size=100000, seed=None
+):
+    """Runs a behaviour policy on FleetEnv for the given number of steps and
+    writes the transitions (obs, action, reward, next_obs, done) to a
+    chunked dataset on disk. With more than one environment, they run in
+    parallel worker processes.
+
+    The policy takes a batch of observations and returns a batch of flat
+    actions.
+    """
+    env_kwargs = {"save_episodes": False, **(env_kwargs or {})}
+    if num_envs > 1:
+        env = VecFleetEnv(num_envs, env_kwargs, seed=seed)
+    else:
+        env = _SingleEnv(FleetEnv(**env_kwargs), seed)
+
+    writer = _ChunkWriter(path, env.observation_space.shape, chunk_size)
+    obs = env.reset()
+    for _ in range(steps):
+        actions = np.asarray(policy(obs))
+        next_obs, rewards, dones, infos = env.step(actions)
+
+        # Environments, which are done, already returned the next episode
+        final_obs = next_obs.copy()
+        for i, info in enumerate(infos):
+            if dones[i]:
+                final_obs[i] = info["terminal_observation"]
+
+        writer.add(obs, actions, rewards, final_obs, dones)
+        obs = next_obs
+
+    env.close()
+    return writer.close()
+
+
+class Dataset:
+    """Transitions of a recorded dataset, memory mapped from disk"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "meta.json") as f:
+            self.meta = json.load(f)
+
+        self.chunks = [
+            {
+                field: np.load(
+                    self.path / ("chunk-%05d" % i) / ("%s.npy" % field), mmap_mode="r"
+                )
+                for field in FIELDS
+            }
+            for i in range(len(self.meta["chunks"]))
+        ]
+
+    def __len__(self):
+        return sum(self.meta["chunks"])
+
+    def minibatches(self, batch_size, shuffle=True, seed=None):
+        """Yields minibatches as contiguous views into the chunks, without
+        copying. Shuffling permutes the order of the minibatches, not the
+        transitions within them.
+        """
+        batches = [
+            (chunk, start)
+            for chunk, size in enumerate(self.meta["chunks"])
+            for start in range(0, size, batch_size)
+        ]
+        if shuffle:
+            np.random.RandomState(seed).shuffle(batches)
+
+        for chunk, start in batches:
+            arrays = self.chunks[chunk]
+            yield {field: arrays[field][start : start + batch_size] for field in FIELDS}
+
+
+class _SingleEnv:
+    """Batch interface of the vectorized environment for one FleetEnv"""
+
+    def __init__(self, env, seed):
+        self.env = env
+        self.env.seed(seed)
+        self.observation_space = env.observation_space
+
+    def reset(self):
+        return np.asarray([self.env.reset()], dtype=np.float64)
+
+    def step(self, actions):
+        ob, reward, done, info = self.env.step(int(actions[0]))
+        if done:
+            info = dict(info, terminal_observation=ob)
+            ob = self.env.reset()
+        return (
+            np.asarray([ob], dtype=np.float64),
+            np.asarray([reward]),
+            np.asarray([done]),
+            [info],
+        )
+
+    def close(self):
+        self.env.close()
+
+
+class _ChunkWriter:
+    def __init__(self, path, obs_shape, chunk_size):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.obs_shape = tuple(obs_shape)
+        self.chunk_size = chunk_size
+        self.chunks = list()
+        self._new_buffer()
+
+    def _new_buffer(self):
+        n = self.chunk_size
+        self.buffer = {
+            "obs": np.zeros((n,) + self.obs_shape),
+            "action": np.zeros(n, dtype=np.int64),
+            "reward": np.zeros(n),
+            "next_obs": np.zeros((n,) + self.obs_shape),
+            "done": np.zeros(n, dtype=bool),
+        }
+        self.size = 0
+
+    def add(self, obs, actions, rewards, next_obs, dones):
+        values = dict(
+            obs=obs, action=actions, reward=rewards, next_obs=next_obs, done=dones
+        )
+        i = 0
+        while i < len(obs):
+            n = min(len(obs) - i, self.chunk_size - self.size)
+            for field, v in values.items():
+                self.buffer[field][self.size : self.size + n] = v[i : i + n]
+            self.size += n
+            i += n
+            if self.size == self.chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if self.size == 0:
+            return
+        directory = self.path / ("chunk-%05d" % len(self.chunks))
+        directory.mkdir(exist_ok=True)
+        for field, v in self.buffer.items():
+            np.save(directory / ("%s.npy" % field), v[: self.size])
+        logger.info("Wrote %d transitions to %s." % (self.size, directory))
+        self.chunks.append(self.size)
+        self._new_buffer()
+
+    def close(self):
+        self._flush()
+        meta = {"obs_shape": list(self.obs_shape), "chunks": self.chunks}
+        with open(self.path / "meta.json", "w") as f:
+            json.dump(meta, f)
+        return self.path
@@ -2,10 +2,24 @@ from datetime import datetime
 import gym
 from gym import spaces
 from gym.utils import seeding
-import numpy as np
 
 from evsim.controller import Controller, strategy
-from evsim.simulation import Simulation, SimulationConfig
+from evsim.data import load
+from evsim.envs.observation import ObservationBuilder
+from evsim.simulation import Simulation, SimulationConfig, checkpoint
+
+# Immutable data of the simulation, loaded once per process and shared by
+# all environments and episodes
+_data = dict()
+
+
+def shared_data():
+    if not _data:
+        _data["trips"] = load.car2go_trips(False)
+        _data["fleet_capacity"] = load.simulation_baseline()
+        _data["balancing_prices"] = load.balancing_prices()
+        _data["intraday_prices"] = load.intraday_prices()
+    return _data
 
 
 class FleetEnv(gym.Env):
@@ -15,7 +29,52 @@ class FleetEnv(gym.Env):
 
     metadata = {"render.modes": ["human"]}
 
-    def __init__(self):
+    def __init__(
+        self,
+        snapshot=None,
+        save_episodes=True,
+        episode_length=None,
+        random_start=False,
+        action_repeat=1,
+        observations=("hour",),
+    ):
+        """Episodes start from the state of a snapshot, e.g. a checkpoint
+        file, instead of from the beginning of the trips, when given.
+        Results of each episode are written to CSV with save_episodes.
+
+        Episodes last episode_length days or until the end of the trips.
+        With random_start, they start at a random timeslot of the trips,
+        which requires an episode_length and no snapshot.
+        Every action is repeated for action_repeat market periods.
+        Observations consist of the listed features, see observation.FEATURES.
+        """
+        if random_start and episode_length is None:
+            raise ValueError("random_start requires an episode_length.")
+        if random_start and snapshot is not None:
+            raise ValueError("random_start can not be combined with a snapshot.")
+
+        if snapshot is not None and not isinstance(snapshot, dict):
+            snapshot = checkpoint.load(snapshot)
+        self.snapshot = snapshot
+        self.save_episodes = save_episodes
+        self.episode_length = episode_length
+        self.random_start = random_start
+        self.action_repeat = action_repeat
+        self.observations = ObservationBuilder(observations)
+
+        self.seed()
+
+        data = shared_data()
+        cfg = SimulationConfig() if snapshot is None else snapshot["cfg"]
+        self.controller = Controller(
+            cfg,
+            strategy.integrated,
+            accuracy=(70, 90),
+            imbalance_costs=3000,
+            fleet_capacity=data["fleet_capacity"],
+            balancing_prices=data["balancing_prices"],
+            intraday_prices=data["intraday_prices"],
+        )
 
         # Initialize evsim
         self.init_sim()
@@ -26,12 +85,10 @@ class FleetEnv(gym.Env):
         self.action_space = spaces.Tuple((spaces.Discrete(11), spaces.Discrete(11)))
 
         # Define what the agent can observe:
-        #    Current time in hours [0-23]
-        low = np.array([0])
-        high = np.array([23])
-        self.observation_space = spaces.Box(low, high, dtype=np.int64)
+        #    By default current time in hours [0-23]
+        self.observation_space = self.observations.space()
 
-        self.curr_balance = 0
+        self.curr_balance = self.controller.account.balance
         self._realtime = self.sim.env.now
 
         self.episode = 0
@@ -41,11 +98,42 @@ class FleetEnv(gym.Env):
         return datetime.fromtimestamp(self._realtime)
 
     def init_sim(self):
-        cfg = SimulationConfig()
-        self.controller = Controller(
-            cfg, strategy.integrated, accuracy=(70, 90), imbalance_costs=3000
+        """Starts a new simulation on the shared data. Only the mutable state,
+        i.e. fleet, plans, account and clock, is created anew.
+        """
+        self.controller.reset()
+        trips = shared_data()["trips"]
+        start, end = self._episode_window(trips)
+        self.sim = Simulation(
+            self.controller.cfg,
+            self.controller,
+            trips=trips,
+            start_time=start,
+            end_time=end,
+            skip_quiet=False,
         )
-        self.sim = Simulation(cfg, self.controller)
+        if self.snapshot is not None:
+            self.sim.restore(self.snapshot, random_state=False)
+
+    def _episode_window(self, trips):
+        if self.snapshot is None:
+            start = int(trips.start_time.min())
+            end = int(trips.end_time.max())
+        else:
+            start, end = self.snapshot["now"], self.snapshot["end_time"]
+
+        if self.episode_length is None:
+            return start, end
+
+        length = int(self.episode_length * 24 * 60 * 60)
+        if self.random_start and end - start > length:
+            # Start at a random timeslot, leaving room for a full episode
+            timeslot = self.controller.cfg.timeslot
+            start += (
+                int(self.np_random.randint((end - start - length) // timeslot + 1))
+                * timeslot
+            )
+        return start, min(end, start + length)
 
     def imbalance_costs(self, cost):
         self.controller.imbalance_costs = cost
@@ -58,14 +146,15 @@ class FleetEnv(gym.Env):
         # Transform "flat" action back to tuple
         risk = ((action // 11) / 10, (action % 11) / 10)
 
-        balance, done = self.sim.step(risk=risk, minutes=15)
+        balance, done = self.sim.step(
+            risk=risk, minutes=self.sim.cfg.market_period * self.action_repeat
+        )
         reward = balance - self.curr_balance
 
         self.curr_balance = balance
         self._realtime = self.sim.env.now
 
-        hour = self.realtime.hour
-        ob = [hour]
+        ob = self.observations.build(self.sim)
 
         return ob, reward, done, {}
 
@@ -73,18 +162,17 @@ class FleetEnv(gym.Env):
         """ Returns observation """
 
         # Save simulation results
-        if self.episode > 0:
+        if self.episode > 0 and self.save_episodes:
             self.save_results("./results/sim_result_ep_{}.csv".format(self.episode))
 
         self.episode += 1
-        self.curr_balance = 0
 
         del self.sim
         self.init_sim()
+        self.curr_balance = self.controller.account.balance
 
         self._realtime = self.sim.env.now
-        ob = self.realtime.hour
-        return [ob]
+        return self.observations.build(self.sim)
 
     def save_results(self, filename):
         self.sim.results.write(filename)
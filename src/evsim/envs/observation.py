@@ -0,0 +1,110 @@
+from datetime import datetime
+import numpy as np
+from gym import spaces
+
+from evsim.controller.strategy import minute, week
+
+
+def _hour(sim):
+    return datetime.fromtimestamp(sim.env.now).hour
+
+
+def _weekday(sim):
+    return datetime.fromtimestamp(sim.env.now).weekday()
+
+
+def _hour_sin(sim):
+    return np.sin(2 * np.pi * _hour(sim) / 24)
+
+
+def _hour_cos(sim):
+    return np.cos(2 * np.pi * _hour(sim) / 24)
+
+
+def _vpp_evs(sim):
+    return len(sim.vpp.evs)
+
+
+def _vpp_soc(sim):
+    return sim.vpp.mean_soc()
+
+
+def _available_kw(sim):
+    return sim.vpp.capacity()
+
+
+def _commited_kw(sim):
+    return sim.controller.planned_kw(sim.env.now)
+
+
+def _intraday_price(sim):
+    return _price(sim, sim.controller.intraday_market, sim.env.now + (30 * minute))
+
+
+def _balancing_price(sim):
+    return _price(sim, sim.controller.balancing_market, sim.env.now + week)
+
+
+# Features an observation can be built from:
+#    name: (function of the simulation, lower bound, upper bound, integer)
+# Prices are NaN for market periods without data.
+FEATURES = {
+    "hour": (_hour, 0, 23, True),
+    "weekday": (_weekday, 0, 6, True),
+    "hour_sin": (_hour_sin, -1, 1, False),
+    "hour_cos": (_hour_cos, -1, 1, False),
+    "vpp_evs": (_vpp_evs, 0, np.inf, True),
+    "vpp_soc": (_vpp_soc, 0, 100, False),
+    "available_kw": (_available_kw, 0, np.inf, False),
+    "commited_kw": (_commited_kw, 0, np.inf, False),
+    "intraday_price": (_intraday_price, -np.inf, np.inf, False),
+    "balancing_price": (_balancing_price, -np.inf, np.inf, False),
+}
+
+
+class ObservationBuilder:
+    """
+    Builds observations of a simulation from a list of feature names, e.g.
+    ["hour", "vpp_soc", "intraday_price"]. Every feature is read from
+    running aggregates of the simulation or indexed market data, in
+    constant time per step.
+    """
+
+    def __init__(self, spec=("hour",)):
+        unknown = [name for name in spec if name not in FEATURES]
+        if unknown:
+            raise ValueError("Unknown observation features: %s" % ", ".join(unknown))
+
+        self.spec = list(spec)
+        self.features = [FEATURES[name][0] for name in self.spec]
+        self.low = np.array([FEATURES[name][1] for name in self.spec])
+        self.high = np.array([FEATURES[name][2] for name in self.spec])
+
+        # NOTE: Infinite bounds have no integer representation
+        self.dtype = np.float64
+        if (
+            all(FEATURES[name][3] for name in self.spec)
+            and np.isfinite(np.concatenate([self.low, self.high])).all()
+        ):
+            self.dtype = np.int64
+
+    def space(self):
+        return spaces.Box(self.low, self.high, dtype=self.dtype)
+
+    def build(self, sim):
+        return np.array([feature(sim) for feature in self.features], dtype=self.dtype)
+
+
+def _next_period(t, market_period=15):
+    """Start of the next market period, given in minutes"""
+    return t + (-t % (market_period * minute))
+
+
+def _price(sim, market, t):
+    """Clearing price of the next market period after t, NaN if not in data,
+    as any number could be a real price
+    """
+    try:
+        return market.clearing_price(_next_period(t, sim.cfg.market_period))
+    except ValueError:
+        return np.nan
@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+import random
+
+from evsim.envs import fleet_env
+
+
+class VecFleetEnv:
+    """
+    Runs several FleetEnv in worker processes and steps them as a batch.
+
+    Observations, rewards and done flags are written by the workers to
+    shared memory mapped files, only commands and infos are sent through
+    pipes. An environment, which is done, is reset right away and returns
+    the first observation of its next episode.
+    """
+
+    def __init__(self, num_envs, env_kwargs=None, seed=None):
+        env_kwargs = env_kwargs or dict()
+
+        # Load data before forking, to share it with all workers
+        if "fork" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("fork")
+            fleet_env.shared_data()
+        else:
+            ctx = multiprocessing.get_context()
+
+        self.num_envs = num_envs
+        self.closed = False
+
+        self.remotes, self.processes = list(), list()
+        for i in range(num_envs):
+            remote, worker_remote = ctx.Pipe()
+            p = ctx.Process(
+                target=_worker, args=(worker_remote, i, env_kwargs), daemon=True
+            )
+            p.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(p)
+
+        # Observation space of the first environment sizes the buffers
+        self.observation_space, self.action_space = self.remotes[0].recv()
+
+        # NOTE: Buffers are files, as workers can only inherit shared arrays
+        shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        self._buffers = tempfile.mkdtemp(prefix="evsim-", dir=shm)
+        shape = (num_envs,) + self.observation_space.shape
+        self.obs, self.rewards, self.dones = _buffers(self._buffers, shape, "w+")
+        for remote in self.remotes:
+            remote.send(("buffers", (self._buffers, shape)))
+        for remote in self.remotes:
+            remote.recv()
+
+        if seed is not None:
+            self.seed(seed)
+
+    def seed(self, seed=None):
+        """Seeds every worker differently, with seed + index of the worker"""
+        for i, remote in enumerate(self.remotes):
+            remote.send(("seed", None if seed is None else seed + i))
+        return [remote.recv() for remote in self.remotes]
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.obs.copy()
+
+    def step(self, actions):
+        """Steps all environments with one action each. Returns the batched
+        observations, rewards, done flags and infos.
+        """
+        if len(actions) != len(self.remotes):
+            raise ValueError(
+                "Expected %d actions, one per environment, got %d."
+                % (len(self.remotes), len(actions))
+            )
+        for remote, action in zip(self.remotes, actions):
+            remote.send(("step", int(action)))
+        infos = [remote.recv() for remote in self.remotes]
+        return self.obs.copy(), self.rewards.copy(), self.dones.astype(bool), infos
+
+    def call(self, name, *args):
+        """Calls a method on every environment, e.g. prediction_accuracy"""
+        for remote in self.remotes:
+            remote.send(("call", (name, args)))
+        return [remote.recv() for remote in self.remotes]
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for p in self.processes:
+            p.join()
+        shutil.rmtree(self._buffers, ignore_errors=True)
+        self.closed = True
+
+
+def _buffers(directory, shape, mode):
+    """Observations, rewards and done flags of all environments"""
+    path = os.path.join
+    return (
+        np.memmap(path(directory, "obs"), np.float64, mode, shape=shape),
+        np.memmap(path(directory, "rewards"), np.float64, mode, shape=shape[:1]),
+        np.memmap(path(directory, "dones"), np.int8, mode, shape=shape[:1]),
+    )
+
+
+def _worker(remote, index, env_kwargs):
+    env = fleet_env.FleetEnv(**env_kwargs)
+    if index == 0:
+        remote.send((env.observation_space, env.action_space))
+
+    while True:
+        cmd, data = remote.recv()
+        if cmd == "buffers":
+            obs, rewards, dones = _buffers(*data, "r+")
+            remote.send(None)
+        elif cmd == "step":
+            ob, reward, done, info = env.step(data)
+            if done:
+                info = dict(info, terminal_observation=ob)
+                ob = env.reset()
+            obs[index] = ob
+            rewards[index] = reward
+            dones[index] = done
+            remote.send(info)
+        elif cmd == "reset":
+            obs[index] = env.reset()
+            rewards[index] = 0
+            dones[index] = False
+            remote.send(None)
+        elif cmd == "seed":
+            # The simulation draws from the global random generators
+            random.seed(data)
+            np.random.seed(data)
+            remote.send(env.seed(data))
+        elif cmd == "call":
+            name, args = data
+            remote.send(getattr(env, name)(*args))
+        elif cmd == "close":
+            env.close()
+            remote.close()
+            break
@@ -1,15 +1,20 @@
 import click
-from datetime import datetime
+import csv
+from dataclasses import replace
+from datetime import datetime, timezone
+import itertools
+import json
 import logging
 import os
 import time
 
-from evsim.controller import Controller, strategy
-from evsim.data import load
-from evsim.simulation import Simulation, SimulationConfig
-
+# NOTE: Commands import the simulation themselves, to keep the start of the
+# CLI, e.g. for --help and shell completion, free from pandas, SimPy and gym
 logger = logging.getLogger(__name__)
 
+# Timeslots per request of a batch prediction
+BATCH_SIZE = 10000
+
 
 @click.group(name="evsim")
 @click.option("--debug/--no-debug", default=False)
@@ -51,8 +56,39 @@ def cli(ctx, debug, name, logs):
     )
 
 
+def period_options(f):
+    """Options of the time grid of a simulation"""
+    options = [
+        click.option(
+            "--control-period",
+            default=5,
+            help="Minutes between charging decisions for the fleet.",
+            show_default=True,
+        ),
+        click.option(
+            "--market-period",
+            default=15,
+            help="Minutes of a market product, a multiple of the control period.",
+            show_default=True,
+        ),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def _config(ctx, *args):
+    from evsim.simulation import SimulationConfig
+
+    try:
+        return SimulationConfig(ctx.obj["NAME"], *args)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--market-period") from e
+
+
 @cli.command(help="Start the EV Simulation.")
 @click.pass_context
+@period_options
 @click.option(
     "-c",
     "--ev-capacity",
@@ -77,33 +113,111 @@ def cli(ctx, debug, name, logs):
 @click.option(
     "--charging-strategy",
     type=click.Choice(["regular", "balancing", "intraday", "integrated"]),
-    default="regular",
-    help="Charging strategy",
-    show_default=True,
+    default=None,
+    help="Charging strategy  [default: regular]",
 )
 @click.option(
     "-a",
     "--accuracy",
     type=(int, int),
-    help="Prediction accuracy.",
-    default=(100, 100),
-    show_default=True,
+    help="Prediction accuracy.  [default: 100 100]",
+    default=None,
 )
 @click.option(
     "-r",
     "--risk",
     type=(float, float),
-    help="Bidding risk to account for uncertainty",
-    default=(0.0, 0.0),
-    show_default=True,
+    help="Bidding risk to account for uncertainty  [default: 0.0 0.0]",
+    default=None,
 )
 @click.option(
     "--refuse-rentals/--no-refuse-rentals",
-    default=True,
-    help="Refuses rentals of EV that are commited to VPP.",
+    default=None,
+    help="Refuses rentals of EV that are commited to VPP.  [default: on]",
+)
+@click.option(
+    "--shard-freq",
+    default=None,
+    help="Split the time range into shards simulated in parallel, e.g. MS (monthly).",
+)
+@click.option(
+    "--warmup-days",
+    default=7,
+    help="Days each shard is simulated ahead to build up fleet state.",
+    show_default=True,
+)
+@click.option(
+    "-p",
+    "--processes",
+    type=int,
+    default=None,
+    help="Number of worker processes for shards. Defaults to the number of cores.",
+)
+@click.option(
+    "--validate",
+    is_flag=True,
+    help="Also simulate sequentially and report the error at shard boundaries.",
+)
+@click.option(
+    "--checkpoint-every",
+    type=float,
+    default=None,
+    help="Save a checkpoint to ./checkpoints every given number of simulated days.",
+)
+@click.option(
+    "--resume",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help=(
+        "Resume from a checkpoint with its strategy. Strategy options given "
+        "replace it from the checkpoint on, e.g. to branch what-if runs."
+    ),
+)
+@click.option(
+    "--synthetic",
+    default=None,
+    help="Simulate the trips of a synthetic fleet, see evsim build synthetic.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Time the phases of every timeslot and count events, written to ./results.",
+)
+@click.option(
+    "--memprofile",
+    is_flag=True,
+    help="Trace allocations and sizes of the main structures, written to ./results.",
+)
+@click.option(
+    "--memprofile-every",
+    type=float,
+    default=6,
+    show_default=True,
+    help="Snapshot the memory every given number of simulated hours.",
+)
+@click.option(
+    "--record-trace",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Record the VPP availability of every timeslot to a file for replays.",
+)
+@click.option(
+    "--progress",
+    type=float,
+    default=10,
+    show_default=True,
+    help="Report the progress every given number of seconds, 0 turns it off.",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Append the progress reports as JSON lines to a file, e.g. to tail.",
 )
 def simulate(
     ctx,
+    control_period,
+    market_period,
     ev_capacity,
     charging_speed,
     charging_strategy,
@@ -111,17 +225,54 @@ def simulate(
     refuse_rentals,
     accuracy,
     risk,
+    shard_freq,
+    warmup_days,
+    processes,
+    validate,
+    checkpoint_every,
+    resume,
+    synthetic,
+    profile,
+    memprofile,
+    memprofile_every,
+    record_trace,
+    progress,
+    metrics_file,
 ):
+    from evsim.controller import Controller, strategy
+    from evsim.data import load
+    from evsim.simulation import Simulation
+    from evsim.simulation import checkpoint, replay, sweep as sweeps
+
+    # Strategy options replace the strategy of a checkpoint, if given
+    options = [charging_strategy, accuracy, risk, refuse_rentals]
+    restore_strategy = resume and options == [None, None, None, None]
+    charging_strategy = charging_strategy or "regular"
+    accuracy = accuracy or (100, 100)
+    risk = risk or (0.0, 0.0)
+    refuse_rentals = True if refuse_rentals is None else refuse_rentals
+
     click.echo("--- Simulation Settings: ---")
     click.echo("Debug is %s." % (ctx.obj["DEBUG"] and "on" or "off"))
     click.echo("Writing Logs to file is %s." % (ctx.obj["LOGS"] and "on" or "off"))
     click.echo("EV battery capacity is set to %skWh." % ev_capacity)
     click.echo("Charging speed is set to %skW." % charging_speed)
     click.echo("Industry electricity tariff is set to %sEUR/MWh." % industry_tariff)
-    click.echo("Refusing rentals is set to %s." % (refuse_rentals and "on" or "off"))
-    click.echo("Charging strategy is set to %s" % charging_strategy)
-    click.echo("Prediction accuracy is set to (%d%%, %d%%)." % accuracy)
-    click.echo("Bidding risk is set to (%.2f, %.2f)." % risk)
+    if restore_strategy:
+        click.echo("Strategy options are restored from the checkpoint.")
+    else:
+        click.echo(
+            "Refusing rentals is set to %s." % (refuse_rentals and "on" or "off")
+        )
+        click.echo("Charging strategy is set to %s" % charging_strategy)
+        click.echo("Prediction accuracy is set to (%d%%, %d%%)." % accuracy)
+        click.echo("Bidding risk is set to (%.2f, %.2f)." % risk)
+    click.echo(
+        "Control period is set to %dmin, market period to %dmin."
+        % (control_period, market_period)
+    )
+    if synthetic:
+        click.echo("Simulating synthetic trips %s." % synthetic)
 
     if charging_strategy == "regular":
         s = strategy.regular
@@ -132,22 +283,182 @@ def simulate(
     elif charging_strategy == "integrated":
         s = strategy.integrated
 
-    cfg = SimulationConfig(
-        ctx.obj["NAME"], charging_speed, ev_capacity, industry_tariff
+    cfg = _config(
+        ctx,
+        charging_speed,
+        ev_capacity,
+        industry_tariff,
+        control_period,
+        market_period,
     )
 
-    controller = Controller(
-        cfg, s, accuracy=accuracy, risk=risk, refuse_rentals=refuse_rentals
-    )
-    sim = Simulation(cfg, controller)
+    if profile and shard_freq:
+        raise click.UsageError("--profile is not available with --shard-freq.")
+    if memprofile and shard_freq:
+        raise click.UsageError("--memprofile is not available with --shard-freq.")
+    if metrics_file and shard_freq:
+        raise click.UsageError("--metrics-file is not available with --shard-freq.")
 
     click.echo("--- Starting Simulation: ---")
     start = time.time()
-    sim.start()
+    if shard_freq:
+        click.echo(
+            "Simulating shards of %s with %d days warm-up." % (shard_freq, warmup_days)
+        )
+        scenario = {
+            "charging_strategy": charging_strategy,
+            "accuracy": accuracy,
+            "risk": risk,
+            "refuse_rentals": refuse_rentals,
+        }
+        stats, sim_results, windows = sweeps.run_sharded(
+            cfg, scenario, shard_freq, warmup_days, processes, synthetic
+        )
+        stats.write("./logs/stats-%s.csv" % cfg.name)
+        sim_results.write("./results/%s.csv" % cfg.name)
+    else:
+        trips = load.synthetic_trips(synthetic) if synthetic else None
+        controller = None
+        if not restore_strategy:
+            controller = Controller(
+                cfg, s, accuracy=accuracy, risk=risk, refuse_rentals=refuse_rentals
+            )
+        if resume:
+            click.echo("Resuming from checkpoint %s." % resume)
+            try:
+                sim = checkpoint.resume(resume, controller, cfg.name, trips, cfg)
+            except ValueError as e:
+                raise click.UsageError(str(e)) from e
+        else:
+            sim = Simulation(cfg, controller, trips)
+        if record_trace:
+            sim.trace = replay.TraceRecorder()
+        if profile:
+            sim.enable_profile()
+        if memprofile:
+            sim.enable_memprofile(int(memprofile_every * 60 * 60))
+        if progress > 0 or metrics_file:
+            # Without reports, metrics are written at the default interval
+            sim.enable_progress(
+                progress or 10,
+                metrics_file,
+                lambda line: progress > 0 and click.echo(line, err=True),
+            )
+        if checkpoint_every:
+            checkpoint.run(sim, int(checkpoint_every * 24 * 60 * 60))
+        sim.start()
+        sim_results = sim.results
+        if record_trace:
+            sim.trace.save(record_trace, cfg)
+            click.echo("Wrote trace to %s" % record_trace)
 
     click.echo("--- Simulation Results: ---")
 
-    results = sim.results.sum()
+    results = sim_results.sum()
+    click.echo("Energy charged as VPP: %.2fMWh" % (results.charged_vpp_kwh / 1000))
+    click.echo(
+        "Energy charged regularly: %.2fMWh" % (results.charged_regular_kwh / 1000)
+    )
+    click.echo(
+        "Energy that couldn't be charged (imbalance): %.2fMWh"
+        % (results.imbalance_kwh / 1000)
+    )
+    click.echo("Total charging profits: %.2fEUR" % results.profit_eur)
+    click.echo(
+        "Total lost rental costs: %.2fEUR (%d rentals)"
+        % (results.lost_rentals_eur, results.lost_rentals_nb)
+    )
+    click.echo("Elapsed time %.2f minutes" % ((time.time() - start) / 60))
+
+    if profile:
+        click.echo("--- Profile: ---")
+        click.echo(sim.profile.table().round(3).to_string(index=False))
+        for counter, n in sorted(sim.profile.counts.items()):
+            click.echo("%s: %d" % (counter, n))
+        filename = "./results/profile-%s.json" % cfg.name
+        sim.profile.save(filename)
+        click.echo("Wrote profile to %s" % filename)
+
+    if memprofile:
+        click.echo("--- Memory Profile: ---")
+        sizes = sim.memprofile.table().iloc[-1]
+        for column, size in sizes.drop(["timestamp", "events", "evs"]).items():
+            click.echo("%s: %.1fMB" % (column[: -len("_bytes")], size / 2 ** 20))
+        sizes, top = sim.memprofile.save("./results/memprofile-%s.csv" % cfg.name)
+        click.echo("Wrote memory profile to %s and %s" % (sizes, top))
+
+    if shard_freq and validate:
+        click.echo("--- Validating against sequential Simulation: ---")
+        controller = Controller(
+            cfg, s, accuracy=accuracy, risk=risk, refuse_rentals=refuse_rentals
+        )
+        trips = load.synthetic_trips(synthetic) if synthetic else None
+        sim = Simulation(cfg, controller, trips)
+        while not sim.done:
+            sim.step()
+
+        errors = sweeps.boundary_error(sim_results, sim.results, windows)
+        click.echo(errors.round(2).to_string(index=False))
+
+
+@cli.command(
+    name="replay", help="Replay a recorded trace with another charging strategy."
+)
+@click.pass_context
+@click.argument("trace", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--charging-strategy",
+    type=click.Choice(["regular", "balancing", "intraday", "integrated"]),
+    default="regular",
+    help="Charging strategy",
+    show_default=True,
+)
+@click.option(
+    "-a",
+    "--accuracy",
+    type=(int, int),
+    help="Prediction accuracy.",
+    default=(100, 100),
+    show_default=True,
+)
+@click.option(
+    "-r",
+    "--risk",
+    type=(float, float),
+    help="Bidding risk to account for uncertainty",
+    default=(0.0, 0.0),
+    show_default=True,
+)
+@click.option(
+    "--refuse-rentals/--no-refuse-rentals",
+    default=True,
+    help="Refuses rentals of EV that are commited to VPP (approximated).",
+)
+def replay_trace(ctx, trace, charging_strategy, accuracy, risk, refuse_rentals):
+    """Replays the VPP availability of a trace, recorded with
+    simulate --record-trace, without simulating the trips. Refused rentals
+    are approximated, as the trace does not change with the strategy.
+    """
+    from evsim.controller import Controller, strategy
+    from evsim.simulation import replay
+
+    start = time.time()
+    data = replay.load_trace(trace)
+    click.echo("Replaying %s" % replay.describe(data))
+
+    cfg = replace(data["cfg"], name=ctx.obj["NAME"])
+    controller = Controller(
+        cfg,
+        getattr(strategy, charging_strategy),
+        accuracy=accuracy,
+        risk=risk,
+        refuse_rentals=refuse_rentals,
+    )
+    sim = replay.Replay(data, controller, cfg)
+    results = sim.start()
+    sim.results.write("./results/%s.csv" % cfg.name)
+
+    click.echo("--- Replay Results: ---")
     click.echo("Energy charged as VPP: %.2fMWh" % (results.charged_vpp_kwh / 1000))
     click.echo(
         "Energy charged regularly: %.2fMWh" % (results.charged_regular_kwh / 1000)
@@ -161,9 +472,194 @@ def simulate(
         "Total lost rental costs: %.2fEUR (%d rentals)"
         % (results.lost_rentals_eur, results.lost_rentals_nb)
     )
+    if sim.approximated:
+        click.echo(
+            "Approximated refused rentals in %d timeslots." % len(sim.approximated)
+        )
+    click.echo("Elapsed time %.2f minutes" % ((time.time() - start) / 60))
+
+
+@cli.command(help="Run a parameter sweep of simulations in parallel.")
+@click.pass_context
+@period_options
+@click.argument("grid", type=click.File("r"))
+@click.option(
+    "-p",
+    "--processes",
+    type=int,
+    default=None,
+    help="Number of worker processes. Defaults to the number of cores.",
+)
+@click.option(
+    "--lockstep",
+    is_flag=True,
+    help="Simulate the scenarios of each worker in one pass over the trips.",
+)
+@click.option(
+    "-c",
+    "--ev-capacity",
+    default=17.6,
+    help="Battery capacity of EV in kWh.",
+    show_default=True,
+)
+@click.option(
+    "-i",
+    "--industry-tariff",
+    default=150,
+    help="Flat industry tariff, which the fleet can charge regularly.",
+    show_default=True,
+)
+@click.option(
+    "-s",
+    "--charging-speed",
+    default=3.6,
+    help="Charging power in kW.",
+    show_default=True,
+)
+@click.option(
+    "--synthetic",
+    default=None,
+    help="Simulate the trips of a synthetic fleet, see evsim build synthetic.",
+)
+def sweep(
+    ctx,
+    control_period,
+    market_period,
+    grid,
+    processes,
+    lockstep,
+    ev_capacity,
+    industry_tariff,
+    charging_speed,
+    synthetic,
+):
+    """GRID is a JSON file mapping scenario parameters to lists of values, e.g.
+    {"charging_strategy": ["intraday"], "risk": [[0, 0], [0.1, 0.1]]}.
+    Available parameters: charging_strategy, risk, accuracy, refuse_rentals.
+    """
+    from evsim.simulation import sweep as sweeps
+
+    try:
+        scenarios = sweeps.grid(json.load(grid))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="GRID") from e
+
+    cfg = _config(
+        ctx,
+        charging_speed,
+        ev_capacity,
+        industry_tariff,
+        control_period,
+        market_period,
+    )
+
+    click.echo("--- Starting Sweep of %d Scenarios: ---" % len(scenarios))
+    start = time.time()
+    df = sweeps.run(cfg, scenarios, processes, lockstep, synthetic)
+
+    filename = "./results/sweep-%s.csv" % cfg.name
+    os.makedirs("./results", exist_ok=True)
+    df.round(2).to_csv(filename, index=False)
+
+    click.echo("--- Sweep Results: ---")
+    click.echo(sweeps.summary(df).round(2).to_string(index=False))
+    click.echo("Wrote results of all scenarios to %s" % filename)
     click.echo("Elapsed time %.2f minutes" % ((time.time() - start) / 60))
 
 
+@cli.command(help="Benchmark the data pipeline, simulation and controller.")
+@click.option(
+    "--scale",
+    type=click.Choice(["small", "medium", "large"]),
+    default="small",
+    help="Size of the fixtures.",
+    show_default=True,
+)
+@click.option(
+    "-r",
+    "--repeat",
+    default=3,
+    help="Repetitions of every benchmark, the best is reported.",
+    show_default=True,
+)
+@click.option(
+    "-b",
+    "--benchmark",
+    "names",
+    multiple=True,
+    help="Run only the given benchmark, can be repeated.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False),
+    default="./results/benchmark.json",
+    help="JSON file for the results.",
+    show_default=True,
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="JSON results of an earlier run to compare against.",
+)
+@click.option(
+    "--tolerance",
+    default=0.2,
+    help="Drop of throughput against the baseline flagged as regression.",
+    show_default=True,
+)
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Check that equivalent simulations give identical results instead.",
+)
+def benchmark(scale, repeat, names, output, baseline, tolerance, check):
+    from evsim import benchmark as benchmarks
+
+    unknown = set(names) - set(benchmarks.CHECKS if check else benchmarks.BENCHMARKS)
+    if unknown:
+        raise click.BadParameter(
+            "Unknown benchmarks: %s" % ", ".join(sorted(unknown)),
+            param_hint="--benchmark",
+        )
+
+    if check:
+        click.echo("--- Running Checks (%s): ---" % scale)
+        df = benchmarks.check(scale, names)
+        click.echo(df.to_string(index=False))
+        if not df["ok"].all():
+            raise click.ClickException(
+                "Failed: %s"
+                % ", ".join(
+                    df.loc[~df["ok"], "check"] + " " + df.loc[~df["ok"], "case"]
+                )
+            )
+        return
+
+    click.echo("--- Running Benchmarks (%s): ---" % scale)
+    report = benchmarks.run(scale, repeat, names)
+    for name, result in report["results"].items():
+        click.echo(
+            "%-26s %10.3fs %14.0f %s/s"
+            % (name, result["seconds"], result["rate"], result["unit"])
+        )
+    benchmarks.save(report, output)
+    click.echo("Wrote benchmark results to %s" % output)
+
+    if baseline:
+        click.echo("--- Comparison with %s: ---" % baseline)
+        try:
+            df = benchmarks.compare(report, benchmarks.load(baseline), tolerance)
+        except ValueError as e:
+            raise click.ClickException(str(e)) from e
+        click.echo(df.round(3).to_string(index=False))
+        if df["regression"].any():
+            raise click.ClickException(
+                "Regressions: %s" % ", ".join(df.loc[df["regression"], "benchmark"])
+            )
+
+
 @cli.group(help="(Re)build data sources.")
 @click.pass_context
 def build(ctx):
@@ -193,6 +689,8 @@ def build(ctx):
     show_default=True,
 )
 def all(ev_capacity, ev_range, charging_speed):
+    from evsim.data import load
+
     click.echo("Building all data sources...")
     load.rebuild(charging_speed, ev_capacity, ev_range)
 
@@ -211,6 +709,8 @@ def all(ev_capacity, ev_range, charging_speed):
     help="Infer charging stations by GPS data.",
 )
 def trips(ev_range, infer_chargers):
+    from evsim.data import load
+
     click.echo("Maximal EV range is set to %skm." % ev_range)
     click.echo("Building car2go trip data...")
     click.echo("Infer Chargers is %s." % (infer_chargers and "on" or "off"))
@@ -230,6 +730,8 @@ def trips(ev_range, infer_chargers):
 )
 @click.option("--simulate-charging/--no-simulate-charging", default=False)
 def car2go_capacity(ev_capacity, ev_range, charging_speed, simulate_charging):
+    from evsim.data import load
+
     click.echo("Maximal EV range is set to %skm." % ev_range)
     click.echo("EV battery capacity is set to %skWh." % ev_capacity)
     click.echo("Charging speed is set to %skW." % charging_speed)
@@ -245,25 +747,121 @@ def car2go_capacity(ev_capacity, ev_range, charging_speed, simulate_charging):
 
 @build.command(help="(Re)build intraday price data.")
 def intraday_prices():
+    from evsim.data import load
+
     click.echo("Rebuilding intraday price data...")
     load.intraday_prices(rebuild=True)
 
 
 @build.command(help="(Re)build balancing price data.")
 def balancing_prices():
+    from evsim.data import load
+
     click.echo("Rebuilding balanacing price data...")
     load.balancing_prices(rebuild=True)
 
 
+@build.command(help="Generate trips of a synthetic fleet, fitted to the car2go trips.")
+@click.argument("name")
+@click.option("-e", "--evs", type=int, required=True, help="Number of EVs.")
+@click.option(
+    "-d", "--days", type=int, default=28, help="Days of trips.", show_default=True
+)
+@click.option(
+    "--start",
+    default=None,
+    help="Start of the trips e.g. '2018-01-01', defaults to the car2go start.",
+)
+@click.option("--seed", type=int, default=None, help="Seed of the generator.")
+def synthetic(name, evs, days, start, seed):
+    from evsim.data import load
+
+    if start is not None:
+        start = int(datetime.fromisoformat(start).timestamp())
+
+    click.echo("Generating %d days of trips for %d synthetic EVs..." % (days, evs))
+    df = load.synthetic_trips(name, evs, days, start, seed)
+    click.echo(
+        "Generated %d trips. Simulate them with: evsim simulate --synthetic %s"
+        % (len(df), name)
+    )
+
+
 @cli.group(help="EV Fleet Controller")
+@click.option(
+    "-a",
+    "--address",
+    default="./evsim-controller.sock",
+    envvar="EVSIM_CONTROLLER",
+    help="Unix socket path or host:port of the controller daemon.",
+    show_default=True,
+)
 @click.pass_context
-def controller(ctx):
-    cfg = SimulationConfig()
-    c = Controller(cfg, strategy.intraday)
-    ctx.obj["CONTROLLER"] = c
+def controller(ctx, address):
+    ctx.obj["ADDRESS"] = address
     return True
 
 
+def _controller_service(ctx):
+    """Client of a running controller daemon, or a local controller"""
+    from evsim.controller import client
+
+    c = client.connect(ctx.obj["ADDRESS"])
+    if c is not None:
+        ctx.call_on_close(c.close)
+        return c
+
+    from evsim.controller import Controller, strategy
+    from evsim.controller.server import Service
+    from evsim.simulation import SimulationConfig
+
+    logger.info("No controller daemon running, loading data locally...")
+    return Service(Controller(SimulationConfig(), strategy.intraday))
+
+
+@controller.command(help="Serve predictions and bids from preloaded data")
+@click.pass_context
+def serve(ctx):
+    from evsim.controller import Controller, server, strategy
+    from evsim.simulation import SimulationConfig
+
+    click.echo("Loading capacity and price data...")
+    c = Controller(SimulationConfig(), strategy.intraday)
+    click.echo("Serving controller on %s" % ctx.obj["ADDRESS"])
+    try:
+        server.serve(server.Service(c), ctx.obj["ADDRESS"])
+    except KeyboardInterrupt:
+        click.echo("Stopped controller daemon.")
+
+
+@controller.command(help="Show request counts and latencies of the daemon")
+@click.pass_context
+def metrics(ctx):
+    from evsim.controller import client
+
+    c = client.connect(ctx.obj["ADDRESS"])
+    if c is None:
+        raise click.ClickException(
+            "No controller daemon running on %s" % ctx.obj["ADDRESS"]
+        )
+    with c:
+        m = c.call("metrics")
+
+    click.echo("Uptime: %.0fs" % m["uptime_s"])
+    for method, stats in sorted(m["methods"].items()):
+        click.echo(
+            "%s: %d requests, %d errors, mean %.3fms, p50 %.3fms, p99 %.3fms"
+            % (
+                method,
+                stats["requests"],
+                stats["errors"],
+                stats.get("mean_ms", 0),
+                stats.get("p50_ms", 0),
+                stats.get("p99_ms", 0),
+            )
+        )
+
+
 @controller.command(help="Bid at a given market")
 @click.option("-p", "--price", help="Price in EUR/MWh.", type=int)
 @click.option("-q", "--quantity", help="Quantity in kW.", type=int)
@@ -279,20 +877,15 @@ def controller(ctx):
 )
 @click.pass_context
 def bid(ctx, price, quantity, timeslot, market):
-    controller = ctx.obj["CONTROLLER"]
-
-    if market == "intraday":
-        market = controller.intraday
-    elif market == "balancing":
-        market = controller.balancing
-
     try:
         ts = int(datetime.fromisoformat(timeslot).timestamp())
-        result = market.bid(ts, price, quantity)
-        if result:
+        service = _controller_service(ctx)
+        if service.call(
+            "bid", timeslot=ts, price=price, quantity=quantity, market=market
+        ):
             click.echo(
-                "Succesful bid for %s at %.2fMWh/%.2fkW"
-                % (datetime.fromtimestamp(result[0]), result[2], result[1])
+                "Succesful bid for %s at %.2fEUR/MWh/%.2fkW"
+                % (datetime.fromtimestamp(ts), price, quantity)
             )
         else:
             click.echo("Bid unsuccessful! Try a higher price next time.")
@@ -306,10 +899,154 @@ def predict(ctx):
     return True
 
 
+def batch_options(step):
+    """Options to predict a batch of timeslots instead of one"""
+
+    def decorator(f):
+        options = [
+            click.option(
+                "--from",
+                "start",
+                help="First timeslot of a range, e.g. '2018-01-01 00:00'.",
+            ),
+            click.option(
+                "--to", "end", help="Last timeslot of a range, e.g. '2018-01-02 00:00'."
+            ),
+            click.option(
+                "--step",
+                default=step,
+                help="Minutes between the timeslots of a range.",
+                show_default=True,
+            ),
+            click.option(
+                "-f",
+                "--file",
+                type=click.File("r"),
+                help="File with one timeslot per line, '-' for stdin.",
+            ),
+            click.option(
+                "-o",
+                "--output",
+                type=click.Path(dir_okay=False, writable=True),
+                help="CSV or .parquet file for batch results, else stdout.",
+            ),
+        ]
+        for option in reversed(options):
+            f = option(f)
+        return f
+
+    return decorator
+
+
+def _parse_timeslot(s):
+    s = s.strip()
+    if s.isdigit():
+        return int(s)
+    return int(datetime.fromisoformat(s).timestamp())
+
+
+def _timeslots(start, end, step, file):
+    """Timeslots of a batch, from a range or a file"""
+    if file is not None:
+        for line in file:
+            if line.strip():
+                yield _parse_timeslot(line)
+    else:
+        t, end = _parse_timeslot(start), _parse_timeslot(end)
+        while t <= end:
+            yield t
+            t += step * 60
+
+
+def _predict(ctx, method, column, single, batch, unit, **params):
+    """Predicts one timeslot, or streams a batch of timeslots to a file"""
+    timeslot, start, end, step, file, output = batch
+    if timeslot is not None:
+        try:
+            ts = _parse_timeslot(timeslot)
+            result = _controller_service(ctx).call(single, timeslot=ts, **params)
+            click.echo("%.2f %s" % (result, unit))
+        except ValueError as e:
+            logger.error(e)
+        return
+
+    if file is None and (start is None or end is None):
+        raise click.UsageError("Predict a --timeslot, a --file or --from and --to.")
+
+    service = _controller_service(ctx)
+    writer = _BatchWriter(output, column)
+    timeslots = _timeslots(start, end, step, file)
+    try:
+        while True:
+            chunk = list(itertools.islice(timeslots, BATCH_SIZE))
+            if not chunk:
+                break
+            writer.write(chunk, service.call(method, timeslots=chunk, **params))
+    except ValueError as e:
+        raise click.ClickException(str(e)) from e
+    finally:
+        writer.close()
+
+
+class _BatchWriter:
+    """Writes batch predictions as CSV, or as Parquet if pyarrow is installed.
+    Timeslots are written in UTC to both.
+    """
+
+    def __init__(self, output, column):
+        self.column = column
+        self.parquet = output is not None and output.endswith(".parquet")
+        self.writer = None
+
+        if self.parquet:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                raise click.ClickException(
+                    "Writing Parquet files requires pyarrow."
+                ) from e
+            self.output = output
+        else:
+            self.file = click.open_file(output or "-", "w")
+            self.csv = csv.writer(self.file, lineterminator="\n")
+            self.csv.writerow(["timeslot", column])
+
+    def write(self, timeslots, values):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.table(
+                {
+                    "timeslot": pa.array(timeslots, pa.timestamp("s", tz="UTC")),
+                    self.column: pa.array(values, pa.float64()),
+                }
+            )
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.output, table.schema)
+            self.writer.write_table(table)
+        else:
+            self.csv.writerows(
+                (_utc(t), "" if v is None else v) for t, v in zip(timeslots, values)
+            )
+
+    def close(self):
+        if self.parquet:
+            if self.writer is not None:
+                self.writer.close()
+        else:
+            self.file.close()
+
+
+def _utc(t):
+    return datetime.fromtimestamp(t, timezone.utc).isoformat(sep=" ")
+
+
 @predict.command(help="Predict clearing price at the intraday market.")
 @click.option(
     "-t", "--timeslot", help="15-min timeslot as string e.g. '2018-01-01 08:15'."
 )
+@batch_options(step=15)
 @click.option(
     "--market",
     type=click.Choice(["balancing", "intraday"]),
@@ -318,46 +1055,47 @@ def predict(ctx):
     show_default=True,
 )
 @click.pass_context
-def clearing_price(ctx, timeslot, market):
-    controller = ctx.obj["CONTROLLER"]
-
-    if market == "intraday":
-        market = controller.intraday_market
-    elif market == "balancing":
-        market = controller.balancing_market
-
-    try:
-        ts = int(datetime.fromisoformat(timeslot).timestamp())
-        click.echo("%.2f EUR/MWh" % market.clearing_price(ts))
-    except ValueError as e:
-        logger.error(e)
+def clearing_price(ctx, timeslot, start, end, step, file, output, market):
+    _predict(
+        ctx,
+        "clearing_prices",
+        "clearing_price_eur_mwh",
+        "clearing_price",
+        (timeslot, start, end, step, file, output),
+        "EUR/MWh",
+        market=market,
+    )
 
 
 @predict.command(help="Predict available fleet capacity.")
 @click.option(
     "-t", "--timeslot", help="5-min timeslot as string e.g. '2018-01-01 08:05'."
 )
+@batch_options(step=5)
 @click.pass_context
-def capacity(ctx, timeslot):
-    controller = ctx.obj["CONTROLLER"]
-
-    try:
-        ts = int(datetime.fromisoformat(timeslot).timestamp())
-        click.echo("%.2f kW" % controller.predict_capacity(ts))
-    except ValueError as e:
-        logger.error(e)
+def capacity(ctx, timeslot, start, end, step, file, output):
+    _predict(
+        ctx,
+        "capacities",
+        "capacity_kw",
+        "capacity",
+        (timeslot, start, end, step, file, output),
+        "kW",
+    )
 
 
 @predict.command(help="Predict minimum available fleet capacity in market period.")
 @click.option(
     "-t", "--timeslot", help="15-min timeslot as string e.g. '2018-01-01 08:05'."
 )
+@batch_options(step=15)
 @click.pass_context
-def min_capacity(ctx, timeslot):
-    controller = ctx.obj["CONTROLLER"]
-
-    try:
-        ts = int(datetime.fromisoformat(timeslot).timestamp())
-        click.echo("%.2f kW" % controller.predict_min_capacity(ts))
-    except ValueError as e:
-        logger.error(e)
+def min_capacity(ctx, timeslot, start, end, step, file, output):
+    _predict(
+        ctx,
+        "min_capacities",
+        "min_capacity_kw",
+        "min_capacity",
+        (timeslot, start, end, step, file, output),
+        "kW",
+    )
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
+import numpy as np
 
 
 @dataclass(frozen=True)
@@ -13,6 +14,20 @@ class Market:
     def __init__(self, data):
         self.data = data
 
+        # Index of the first clearing price of every product time
+        first = ~data["product_time"].duplicated()
+        self._prices = data.loc[first, "clearing_price_mwh"].values
+        self._index = {
+            dt: i
+            for i, dt in enumerate(data.loc[first, "product_time"].dt.to_pydatetime())
+        }
+
+        # Sorted POSIX timestamps of the product times, for batch lookups
+        times = np.array([dt.timestamp() for dt in self._index], dtype=np.int64)
+        order = np.argsort(times)
+        self._times = times[order]
+        self._sorted_prices = self._prices[order]
+
     def place_bid(self, bid):
         """ Bid at intraday market given the price in EUR/MWh and quantity in kW
             at a given timeslot (POSIX timestamp).
@@ -34,10 +49,18 @@ class Market:
         # Market data has datetime format timeslots
         dt = datetime.fromtimestamp(timeslot)
         try:
-            return self.data.loc[
-                self.data["product_time"] == dt, "clearing_price_mwh"
-            ].iat[0]
-        except IndexError:
+            return self._prices[self._index[dt]]
+        except KeyError:
             raise ValueError(
                 "Retrieving clearing price failed: %s is not in data." % dt
             )
+
+    def clearing_prices(self, timeslots):
+        """ Get the clearing prices for an array of timeslots (POSIX
+        timestamps). Returns the clearing prices in EUR/MWh, NaN if not in data.
+        """
+        timeslots = np.asarray(timeslots, dtype=np.int64)
+        i = np.searchsorted(self._times, timeslots)
+        i[i == len(self._times)] = 0
+        found = self._times[i] == timeslots
+        return np.where(found, self._sorted_prices[i], np.nan)
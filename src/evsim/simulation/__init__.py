@@ -1,3 +1,4 @@
 # flake8: noqa
 from .statistic import Statistic, SimEntry, ResultEntry
 from .simulation import Simulation, SimulationConfig
+from .lockstep import LockstepSimulation
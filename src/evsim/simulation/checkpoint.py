@@ -0,0 +1,111 @@
+from dataclasses import replace
+from datetime import datetime
+import logging
+from pathlib import Path
+import pickle
+
+from evsim.controller import Controller, strategy
+from .simulation import Simulation
+
+logger = logging.getLogger(__name__)
+
+
+def save(sim, filename):
+    """Writes the state of a simulation between two timeslots to disk"""
+    filename = Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first, to never leave a broken checkpoint
+    tmp = filename.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(sim.state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(filename)
+
+    logger.info(
+        "Saved checkpoint of %s at %s to %s."
+        % (sim.cfg.name, datetime.fromtimestamp(sim.env.now), filename)
+    )
+    return filename
+
+
+def load(filename):
+    with open(filename, "rb") as f:
+        return pickle.load(f)
+
+
+def resume(filename, controller=None, name=None, trips=None, cfg=None):
+    """Restores a simulation from a checkpoint.
+
+    Without a controller, the controller of the checkpoint is restored.
+    Passing another controller, e.g. with different risk, branches a what-if
+    run off the checkpoint, which starts with its consumption plans and
+    account. The name replaces the name of the checkpointed simulation.
+
+    Raises ValueError, if the config (other than the name) of the
+    controller or the given config, or the trips differ from the checkpoint.
+    """
+    state = load(filename)
+
+    cfg_name = name if name is not None else state["cfg"].name
+    for other in [cfg, controller and controller.cfg]:
+        if other is not None and replace(other, name=cfg_name) != replace(
+            state["cfg"], name=cfg_name
+        ):
+            raise ValueError(
+                "Config differs from the checkpoint: %s instead of %s."
+                % (_cfg_diff(other, state["cfg"]), _cfg_diff(state["cfg"], other))
+            )
+
+    cfg = replace(state["cfg"], name=cfg_name)
+    if controller is None:
+        controller = Controller(
+            cfg,
+            getattr(strategy, state["strategy"]),
+            accuracy=state["accuracy"],
+            risk=state["risk"],
+            imbalance_costs=state["imbalance_costs"],
+            refuse_rentals=state["refuse_rentals"],
+        )
+
+    sim = Simulation(
+        cfg, controller, trips, start_time=state["now"], end_time=state["end_time"]
+    )
+    if "trips" in state and sim.trips_key() != state["trips"]:
+        raise ValueError(
+            "Checkpoint was simulated on other trips, e.g. synthetic instead "
+            "of car2go trips: %s trips from %s to %s."
+            % (
+                state["trips"][0],
+                datetime.fromtimestamp(state["trips"][1]),
+                datetime.fromtimestamp(state["trips"][2]),
+            )
+        )
+    sim.restore(state)
+
+    logger.info(
+        "Resumed %s from checkpoint at %s."
+        % (cfg.name, datetime.fromtimestamp(state["now"]))
+    )
+    return sim
+
+
+def _cfg_diff(a, b):
+    """Fields of config a, which differ from config b"""
+    return ", ".join(
+        "%s=%s" % (k, v)
+        for k, v in vars(a).items()
+        if k != "name" and getattr(b, k) != v
+    )
+
+
+def run(sim, every, directory="./checkpoints"):
+    """Steps the simulation until done, saving a checkpoint every given
+    number of seconds of simulated time.
+    """
+    checkpoint = sim.env.now + every
+    while not sim.done:
+        sim.step()
+        if not sim.done and sim.env.now >= checkpoint:
+            dt = datetime.utcfromtimestamp(sim.env.now).strftime("%Y%m%d-%H%M")
+            save(sim, Path(directory) / ("%s-%s.pkl" % (sim.cfg.name, dt)))
+            checkpoint += every
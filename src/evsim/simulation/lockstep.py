@@ -0,0 +1,299 @@
+from datetime import datetime
+import logging
+import numpy as np
+
+from . import Statistic, SimEntry, ResultEntry
+from evsim.data import load
+
+logger = logging.getLogger(__name__)
+
+
+class Clock:
+    """Stands in for the SimPy environment of controllers, which only read
+    the current time from it.
+    """
+
+    __slots__ = ("now",)
+
+    def __init__(self, now):
+        self.now = now
+
+
+class LockstepSimulation:
+    """Simulates several controllers in lockstep over one shared trip schedule.
+
+    The fleet state of all scenarios is held in (scenarios, EVs) arrays,
+    so that finding trips, starting them and charging the fleet is done
+    once per timeslot for all scenarios. Each controller keeps its own
+    consumption plans, markets and account.
+
+    Results match separate Simulations, see the lockstep check of the
+    benchmarks. All controllers share the global random generator though,
+    so scenarios with less than 100% prediction accuracy draw different
+    distortions than in a separate Simulation.
+    """
+
+    def __init__(self, cfg, controllers, trips=None):
+        self.cfg = cfg
+        self.controllers = controllers
+
+        self.stats = [Statistic() for _ in controllers]
+        self.results = [Statistic() for _ in controllers]
+
+        trips = load.car2go_trips(False) if trips is None else trips
+        self.start_time = int(trips.start_time.min())
+        self.start_time -= self.start_time % cfg.timeslot
+        self.end_time = int(trips.end_time.max())
+
+        # Trip schedule sorted by start, keeping the order of trips in a timeslot
+        trips = trips.iloc[np.argsort(trips["start_time"].values, kind="mergesort")]
+        self.trip_start = trips["start_time"].values.astype(np.int64)
+        self.trip_ev = trips["ev_id"].values.astype(np.int64)
+        self.trip_soc = trips["start_soc"].values.astype(np.float64)
+        self.trip_charge = self.trip_soc - trips["end_soc"].values.astype(np.float64)
+        self.trip_duration = trips["trip_duration"].values.astype(np.int64)
+        self.trip_charger = trips["end_charging"].values == 1
+        self.trip_price = trips["trip_price"].values.astype(np.float64)
+
+        # Fleet state of each scenario
+        k, n = len(controllers), len(trips.EV.cat.categories)
+        self.known = np.zeros(n, dtype=bool)
+        self.soc = np.zeros((k, n))
+        self.vpp = np.zeros((k, n), dtype=bool)
+        self.driving = np.zeros((k, n), dtype=bool)
+        self.charging = np.zeros((k, n), dtype=bool)
+
+        # Trip each EV is currently driving
+        self.return_time = np.zeros((k, n), dtype=np.int64)
+        self.return_charge = np.zeros((k, n))
+        self.return_charger = np.zeros((k, n), dtype=bool)
+        self.return_price = np.zeros((k, n))
+
+        self.refuse = np.array([c.refuse_rentals for c in controllers], dtype=bool)
+        kwh_per_control_period = (cfg.charging_power / 60) * cfg.control_period
+        self.charging_step = 100 * kwh_per_control_period / cfg.ev_capacity
+
+        self.clock = Clock(self.start_time)
+        self.done = False
+
+        # Pass references to controllers
+        for c in controllers:
+            c.env = self.clock
+            c.vpp = None
+
+    def start(self):
+        logger.info(
+            "---- STARTING LOCKSTEP SIMULATION: %d scenarios -----"
+            % len(self.controllers)
+        )
+        while not self.done:
+            self.step()
+
+        for controller, stats, results in zip(
+            self.controllers, self.stats, self.results
+        ):
+            name = controller.cfg.name
+            r = results.sum()
+            logger.info(
+                "---- RESULTS: %s: %.2fEUR profits, %.2fEUR lost rentals -----"
+                % (name, r.profit_eur, r.lost_rentals_eur)
+            )
+            stats.write("./logs/stats-%s.csv" % name)
+            results.write("./results/%s.csv" % name)
+
+    def step(self):
+        """Advance all scenarios by one control period"""
+        t = self.clock.now
+        if t > self.end_time:
+            self.done = True
+        else:
+            logger.info(
+                "[%s] - ---------- TIMESLOT %s ----------"
+                % (datetime.fromtimestamp(t), datetime.fromtimestamp(t))
+            )
+
+            # 1. Return EVs, which arrived during the last timeslot
+            self._return_evs(t)
+
+            # 2. Allocate consumption plans
+            commited_kw = np.array([c.planned_kw(t) for c in self.controllers])
+
+            # 3. Start trips at the timeslot
+            lost_eur, lost_nb = self._start_trips(t, commited_kw)
+
+            # 4. Save simulation stats, 1 sec later when all trips started
+            self.clock.now = t + 1
+            self._add_stats(t)
+
+            # 5. Centrally control charging
+            self._charge_fleet(t, lost_eur, lost_nb)
+
+            self.clock.now = t + self.cfg.timeslot
+
+        return [c.account.balance for c in self.controllers], self.done
+
+    def _return_evs(self, t):
+        # NOTE: EVs arrive one second early, before the timeslot starts
+        kk, ee = np.nonzero(self.driving & (self.return_time < t))
+        if len(kk) == 0:
+            return
+
+        rentals = np.bincount(kk, self.return_price[kk, ee], len(self.controllers))
+        for k in np.flatnonzero(rentals):
+            self.controllers[k].account.rental(rentals[k])
+
+        # Adjust SoC, handles charging during the trip as EV.drive()
+        soc = self.soc[kk, ee]
+        trip_charge = self.return_charge[kk, ee]
+        free = 100 - soc
+        filled = (trip_charge < 0) & (free > 0) & (-trip_charge >= free)
+        charged = (trip_charge < 0) & ~filled & (-trip_charge < free)
+        soc = np.where(filled, soc + free, soc)
+        soc = np.where(charged, soc - trip_charge, soc)
+        soc = np.where(trip_charge > 0, soc - trip_charge, soc)
+        self.soc[kk, ee] = soc
+        self.driving[kk, ee] = False
+
+        # Add to VPP when parked at charger with enough free battery capacity
+        charger = self.return_charger[kk, ee]
+        self.charging[kk, ee] = charger
+        add = charger & (100 - soc >= self.charging_step)
+        self.vpp[kk[add], ee[add]] = True
+
+    def _start_trips(self, t, commited_kw):
+        k = len(self.controllers)
+        lo, hi = np.searchsorted(self.trip_start, [t, t + self.cfg.timeslot])
+        if lo == hi:
+            return np.zeros(k), np.zeros(k, dtype=int)
+
+        ev = self.trip_ev[lo:hi]
+        trip_charge = self.trip_charge[lo:hi]
+        price = self.trip_price[lo:hi]
+
+        # Add EVs to fleet at their first trip
+        new = np.flatnonzero(~self.known[ev])
+        if len(new) > 0:
+            _, first = np.unique(ev[new], return_index=True)
+            new = new[first]
+            self.soc[:, ev[new]] = self.trip_soc[lo:hi][new]
+            self.known[ev[new]] = True
+
+        # 1. Not enough battery for the planned trip
+        lost = (trip_charge > 0) & (self.soc[:, ev] < trip_charge)
+
+        # 2. Refuse rental if other EVs in VPP can not substitute capacity
+        in_vpp = self.vpp[:, ev]
+        candidates = in_vpp & ~lost & self.refuse[:, None]
+        refused = np.zeros_like(lost)
+        num_evs = self.vpp.sum(axis=1)
+        for j in np.flatnonzero(candidates.any(axis=0)):
+            refused[:, j] = candidates[:, j] & (
+                commited_kw > num_evs * self.cfg.charging_power
+            )
+            num_evs -= candidates[:, j] & ~refused[:, j]
+
+        # Account for lost profits in order of the trips
+        lost |= refused
+        lost_prices = np.where(lost, price, 0)
+        lost_eur = np.cumsum(lost_prices, axis=1)[:, -1]
+        for i, j in zip(*np.nonzero(lost)):
+            self.controllers[i].account.subtract(lost_prices[i, j])
+
+        # 3. Remove EVs from VPP and drive
+        kk, jj = np.nonzero(~lost)
+        ee = ev[jj]
+        self.vpp[kk, ee] = False
+        self.driving[kk, ee] = True
+        self.charging[kk, ee] = False
+        self.return_time[kk, ee] = t + (self.trip_duration[lo:hi][jj] * 60) - 1
+        self.return_charge[kk, ee] = trip_charge[jj]
+        self.return_charger[kk, ee] = self.trip_charger[lo:hi][jj]
+        self.return_price[kk, ee] = price[jj]
+
+        return lost_eur, lost.sum(axis=1)
+
+    def _add_stats(self, t):
+        num_fleet = int(self.known.sum())
+        num_vpp = self.vpp.sum(axis=1)
+        fleet_soc = self.soc[:, self.known].sum(axis=1)
+        vpp_soc = np.where(self.vpp, np.round(self.soc, 2), 0).sum(axis=1)
+        available = (~self.driving[:, self.known]).sum(axis=1)
+        charging = self.charging[:, self.known].sum(axis=1)
+
+        for k, stats in enumerate(self.stats):
+            n = int(num_vpp[k])
+            stats.add(
+                SimEntry(
+                    timestamp=t,
+                    fleet_evs=num_fleet,
+                    fleet_soc=fleet_soc[k] / num_fleet if num_fleet else 0,
+                    available_evs=int(available[k]),
+                    charging_evs=int(charging[k]),
+                    vpp_soc=vpp_soc[k] / n if n else 0,
+                    vpp_evs=n,
+                    vpp_charging_power_kw=n * self.cfg.charging_power,
+                )
+            )
+
+    def _charge_fleet(self, t, lost_eur, lost_nb):
+        num_evs = self.vpp.sum(axis=1)
+
+        # 1. Every EV in the VPP charges, either from a plan or regularly
+        increment = np.minimum(self.charging_step, 100 - self.soc)
+        self.soc += np.where(self.vpp & (increment > 0), increment, 0)
+        self.vpp &= 100 - self.soc >= self.charging_step
+
+        for k, controller in enumerate(self.controllers):
+            # 2. Charge balancing and intraday plans, the rest regularly
+            available = int(num_evs[k])
+            vpp_charged_kwh, imbalance_kwh = 0, 0
+            for plan in (controller.balancing_plan, controller.intraday_plan):
+                available, charged, imbalance = _charge_plan(
+                    controller, t, plan, available
+                )
+                vpp_charged_kwh += charged
+                imbalance_kwh += imbalance
+            regular_charged_kwh = controller._evs_to_kwh(available)
+
+            # 3. Execute Bidding strategy
+            profit = controller.strategy(
+                controller, t, controller.risk, controller.accuracy
+            )
+
+            # 4. Account for cost and profits
+            controller.account.subtract(imbalance_kwh * controller.imbalance_costs)
+            controller.account.add(profit)
+
+            rb, ri = controller.risk
+            self.results[k].add(
+                ResultEntry(
+                    timestamp=t,
+                    profit_eur=profit,
+                    lost_rentals_eur=lost_eur[k],
+                    lost_rentals_nb=int(lost_nb[k]),
+                    charged_regular_kwh=regular_charged_kwh,
+                    charged_vpp_kwh=vpp_charged_kwh,
+                    imbalance_kwh=imbalance_kwh,
+                    risk_bal=rb,
+                    risk_intr=ri,
+                )
+            )
+
+
+def _charge_plan(controller, timeslot, plan, num_evs):
+    """Energy charged from a consumption plan by the available EVs, as in
+    Controller.charge_plan(), but without dispatching single EVs.
+    """
+    planned_kw = plan.pop(timeslot)
+    num_plan_evs = int(planned_kw // controller.cfg.charging_power)
+
+    imbalance_kwh = 0
+    if num_plan_evs > num_evs:
+        imbalance_kwh = controller._evs_to_kwh(num_plan_evs - num_evs)
+        controller.warning(
+            "Commited %d EVs, but only %d available, account for imbalance costs "
+            "of %.2fkWh!" % (num_plan_evs, num_evs, imbalance_kwh)
+        )
+        num_plan_evs = num_evs
+
+    return num_evs - num_plan_evs, controller._evs_to_kwh(num_plan_evs), imbalance_kwh
@@ -0,0 +1,154 @@
+from collections import deque
+from datetime import datetime
+import logging
+from pathlib import Path
+import sys
+import tracemalloc
+from types import BuiltinFunctionType, FunctionType, ModuleType
+import numpy as np
+import pandas as pd
+
+from .progress import rss
+
+logger = logging.getLogger(__name__)
+
+# Objects, which are shared by the structures and never measured
+_OPAQUE = (type, ModuleType, FunctionType, BuiltinFunctionType, logging.Logger)
+
+
+class MemoryProfile:
+    """
+    Takes snapshots of the memory of a simulation every interval of
+    simulated time in seconds: the deep size of its major structures, and
+    the top allocation sites traced by tracemalloc.
+
+    Structures are measured without the objects they share, e.g. the
+    SimPy environment, the VPP or the EVs in the VPP and event queue.
+    """
+
+    def __init__(self, sim, every, top=10, frames=1):
+        self.every = every
+        self.top = top
+        self.next = sim.env.now
+        self.sizes = list()
+        self.allocations = list()
+
+        # Leave tracing, which was started elsewhere, running on stop
+        self.tracing = not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start(frames)
+
+    def update(self, sim, force=False):
+        if not force and sim.env.now < self.next:
+            return
+        self.next = sim.env.now + self.every
+        self.snapshot(sim)
+
+    def snapshot(self, sim):
+        now = sim.env.now
+
+        # Take the snapshot first, to not trace the measurements
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        for rank, stat in enumerate(snapshot.statistics("lineno")[: self.top]):
+            frame = stat.traceback[0]
+            self.allocations.append(
+                {
+                    "timestamp": now,
+                    "rank": rank + 1,
+                    "location": "%s:%d" % (frame.filename, frame.lineno),
+                    "size_bytes": stat.size,
+                    "count": stat.count,
+                }
+            )
+
+        controller = sim.controller
+        shared = {id(sim), id(sim.env), id(sim.vpp), id(controller)}
+        evs = shared | {id(ev) for ev in sim.evs.values()}
+        self.sizes.append(
+            {
+                "timestamp": now,
+                "rss_bytes": rss(),
+                "traced_bytes": current,
+                "traced_peak_bytes": peak,
+                "trips_bytes": deep_size(sim.trips, shared),
+                "evs_bytes": deep_size(sim.evs, shared),
+                "vpp_evs_bytes": deep_size(sim.vpp.evs, evs),
+                "stats_bytes": deep_size(sim.stats.stats, shared),
+                "results_bytes": deep_size(sim.results.stats, shared),
+                "balancing_plan_bytes": deep_size(controller.balancing_plan.plan),
+                "intraday_plan_bytes": deep_size(controller.intraday_plan.plan),
+                "event_queue_bytes": deep_size(sim.env._queue, evs),
+                "events": len(sim.env._queue),
+                "evs": len(sim.evs),
+            }
+        )
+        logger.info(
+            "[%s] - Traced memory %.1fMB, peak %.1fMB"
+            % (datetime.fromtimestamp(now), current / 2 ** 20, peak / 2 ** 20)
+        )
+
+    def stop(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def table(self):
+        """Sizes of the structures over simulated time"""
+        return pd.DataFrame(self.sizes)
+
+    def top_allocations(self):
+        return pd.DataFrame(
+            self.allocations,
+            columns=["timestamp", "rank", "location", "size_bytes", "count"],
+        )
+
+    def save(self, filename):
+        """Writes the sizes to the file, and the top allocations next to it"""
+        filename = Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        self.table().to_csv(filename, index=False)
+        top = filename.with_name(filename.stem + "-top" + filename.suffix)
+        self.top_allocations().to_csv(top, index=False)
+        return filename, top
+
+
+def deep_size(obj, shared=()):
+    """Size of an object in bytes with everything it references, except
+    the shared objects (ids), classes, modules, functions and loggers.
+    """
+    seen = set(shared)
+    size = 0
+    todo = [obj]
+    while todo:
+        o = todo.pop()
+        if id(o) in seen or isinstance(o, _OPAQUE):
+            continue
+        seen.add(id(o))
+
+        if isinstance(o, pd.DataFrame):
+            size += int(o.memory_usage(index=True, deep=True).sum())
+            continue
+        if isinstance(o, (pd.Series, pd.Index)):
+            size += int(o.memory_usage(deep=True))
+            continue
+
+        size += sys.getsizeof(o)
+        if isinstance(o, np.ndarray):
+            # NOTE: Views are counted without the data of their base
+            continue
+        if isinstance(o, dict):
+            todo.extend(o.keys())
+            todo.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            todo.extend(o)
+
+        if hasattr(o, "__dict__"):
+            todo.append(o.__dict__)
+        slots = getattr(type(o), "__slots__", ())
+        for slot in [slots] if isinstance(slots, str) else slots:
+            if hasattr(o, slot):
+                todo.append(getattr(o, slot))
+    return size
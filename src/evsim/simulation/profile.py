@@ -0,0 +1,87 @@
+from collections import Counter, defaultdict
+import json
+from pathlib import Path
+import time
+import pandas as pd
+
+
+class Profile:
+    """
+    Accumulates the wall time of the phases of the simulation lifecycle and
+    counts events, e.g. SimPy events, processes and bids.
+
+    A phase is timed from the last lap or mark to the next lap. Time spent
+    outside of the laps, e.g. in the processes of driving EVs, is reported
+    as other.
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.counts = Counter()
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.stopped = None
+
+    def mark(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.times[phase] += now - self.last
+        self.last = now
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    def attach(self, env):
+        """Counts the events processed by a SimPy environment"""
+        step = env.step
+
+        def counted_step():
+            self.counts["simpy_events"] += 1
+            step()
+
+        env.step = counted_step
+
+    def stop(self):
+        self.stopped = time.perf_counter()
+
+    @property
+    def total(self):
+        return (self.stopped or time.perf_counter()) - self.started
+
+    def table(self):
+        times = dict(self.times)
+        times["other"] = max(0, self.total - sum(self.times.values()))
+        df = pd.DataFrame(list(times.items()), columns=["phase", "seconds"])
+        df["share"] = df["seconds"] / self.total
+        return df
+
+    def to_dict(self):
+        return {
+            "total_s": self.total,
+            "phases_s": dict(self.times),
+            "counts": dict(self.counts),
+        }
+
+    def save(self, filename):
+        filename = Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class NullProfile:
+    """Profile that does not measure anything, when profiling is off"""
+
+    def mark(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def count(self, counter, n=1):
+        pass
+
+    def stop(self):
+        pass
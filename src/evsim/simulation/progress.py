@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Progress:
+    """
+    Reports the progress of a simulation: simulated date, percent complete,
+    timeslots per second, ETA and resident memory. Updates are rate-limited
+    to one per interval of wall time.
+
+    Every report is also appended as JSON line to the metrics file, if given,
+    to be tailed by a scraper.
+    """
+
+    def __init__(self, sim, interval=10, metrics=None, echo=None):
+        self.interval = interval
+        self.echo = echo or logger.info
+        self.start_time = sim.env.now
+        self.end_time = sim.end_time
+        self.timeslot = sim.cfg.timeslot
+
+        self.started = time.monotonic()
+        self.last = self.started
+
+        self.metrics = None
+        if metrics is not None:
+            self.metrics = open(metrics, "w")
+
+    def update(self, sim, force=False):
+        now = time.monotonic()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+
+        elapsed = now - self.started
+        simulated = sim.env.now - self.start_time
+        total = max(1, self.end_time - self.start_time)
+        slots_per_s = (simulated / self.timeslot) / elapsed if elapsed > 0 else 0
+        remaining = max(0, self.end_time - sim.env.now) / self.timeslot
+        eta = remaining / slots_per_s if slots_per_s > 0 else None
+        memory = rss()
+
+        self.echo(
+            "[%s] %5.1f%% | %6.0f slots/s | ETA %s | RSS %s"
+            % (
+                datetime.fromtimestamp(sim.env.now),
+                100 * min(1, simulated / total),
+                slots_per_s,
+                "-" if eta is None else timedelta(seconds=int(eta)),
+                "-" if memory is None else "%.0fMB" % (memory / 2 ** 20),
+            )
+        )
+
+        if self.metrics is not None:
+            entry = {
+                "time": time.time(),
+                "sim_time": sim.env.now,
+                "percent": 100 * min(1, simulated / total),
+                "slots_per_s": slots_per_s,
+                "eta_s": eta,
+                "rss_bytes": memory,
+            }
+            self.metrics.write(json.dumps(entry) + "\n")
+            self.metrics.flush()
+
+    def close(self):
+        if self.metrics is not None:
+            self.metrics.close()
+
+
+def rss():
+    """Resident memory of the process in bytes, the peak if the current is
+    not available, None on platforms without either.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # NOTE: Peak resident memory, in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
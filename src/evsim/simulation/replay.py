@@ -0,0 +1,200 @@
+from collections import namedtuple
+from dataclasses import asdict
+from datetime import datetime
+import json
+import logging
+from pathlib import Path
+import numpy as np
+
+from . import Statistic, ResultEntry, SimulationConfig
+from .lockstep import Clock
+from evsim import entities
+
+logger = logging.getLogger(__name__)
+
+Battery = namedtuple("Battery", ["level"])
+
+
+class TraceRecorder:
+    """Records which EVs were available to the VPP at every timeslot of a
+    simulation, and which EVs left it for a trip.
+
+    For a trace of the mobility alone, record with a controller, which does
+    not refuse rentals.
+    """
+
+    def __init__(self):
+        self.timestamps = list()
+        self.evs = list()
+        self.socs = list()
+        self.departures = list()
+
+    def record(self, timeslot, vpp, departures):
+        """Records the VPP after all trips of the timeslot started.
+        Departures are the EVs, which left the VPP for a trip, and its price.
+        """
+        self.timestamps.append(timeslot)
+        self.evs.append(np.fromiter(vpp.evs, dtype=np.int32, count=len(vpp.evs)))
+        self.socs.append(np.array([ev.battery.level for ev in vpp.evs.values()]))
+        self.departures.append(
+            [(ev.id, ev.battery.level, price) for ev, price in departures]
+        )
+
+    def save(self, filename, cfg):
+        filename = Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+
+        departures = [d for slot in self.departures for d in slot]
+        np.savez_compressed(
+            filename,
+            cfg=np.array(json.dumps(asdict(cfg))),
+            timestamps=np.array(self.timestamps, dtype=np.int64),
+            offsets=_offsets(self.evs),
+            evs=_concat(self.evs, np.int32),
+            socs=_concat(self.socs, np.float64),
+            departure_offsets=_offsets(self.departures),
+            departure_evs=np.array([d[0] for d in departures], dtype=np.int32),
+            departure_socs=np.array([d[1] for d in departures], dtype=np.float64),
+            departure_prices=np.array([d[2] for d in departures], dtype=np.float64),
+        )
+        logger.info(
+            "Saved trace of %d timeslots to %s" % (len(self.timestamps), filename)
+        )
+
+
+def load_trace(filename):
+    # NOTE: The config is stored as JSON, a trace never loads pickled objects
+    with np.load(filename) as f:
+        trace = {k: f[k] for k in f.files}
+    trace["cfg"] = SimulationConfig(**json.loads(str(trace["cfg"])))
+    return trace
+
+
+def describe(trace):
+    return "%d timeslots from %s to %s" % (
+        len(trace["timestamps"]),
+        datetime.fromtimestamp(trace["timestamps"][0]),
+        datetime.fromtimestamp(trace["timestamps"][-1]),
+    )
+
+
+class Replay:
+    """
+    Replays a recorded trace with another controller, without SimPy or trips.
+
+    At every timeslot, the EVs of the trace are put into a VPP as stand-ins
+    and charged by the controller, as in the simulation. The SoC of the EVs
+    follows the trace and does not depend on the controller.
+
+    Refused rentals are approximated: When the controller would refuse a
+    rental, the rental is accounted as lost and the EV stays in the VPP for
+    that timeslot only. Such timeslots are flagged in `approximated`.
+    """
+
+    def __init__(self, trace, controller, cfg=None):
+        self.trace = trace
+        self.cfg = trace["cfg"] if cfg is None else cfg
+        self.controller = controller
+        self.results = Statistic()
+        self.approximated = list()
+
+        self.clock = Clock(int(trace["timestamps"][0]))
+        self.vpp = entities.VPP(self.clock, "VPP", 0, self.cfg.charging_power)
+        self.controller.env = self.clock
+        self.controller.vpp = self.vpp
+
+        self.slot = 0
+        self.done = False
+
+    def start(self):
+        while not self.done:
+            self.step()
+        return self.results.sum()
+
+    def step(self):
+        if self.slot >= len(self.trace["timestamps"]):
+            self.done = True
+            return self.controller.account.balance, self.done
+
+        t = int(self.trace["timestamps"][self.slot])
+        self.clock.now = t
+        evs, socs, departures = self._slot(self.slot)
+
+        # 1. Allocate consumption plan
+        self.vpp.commited_capacity = self.controller.planned_kw(t)
+
+        # 2. Approximate refused rentals of EVs, which left the VPP
+        capacity = len(evs) + len(departures[0])
+        lost_eur, lost_nb = 0, 0
+        if self.controller.refuse_rentals:
+            for ev, soc, price in zip(*departures):
+                if self.vpp.commited_capacity > capacity * self.cfg.charging_power:
+                    evs, socs = np.append(evs, ev), np.append(socs, soc)
+                    self.controller.account.subtract(price)
+                    lost_eur += price
+                    lost_nb += 1
+                else:
+                    capacity -= 1
+            if lost_nb > 0:
+                self.approximated.append(t)
+
+        # 3. Charge the EVs of the trace
+        self.vpp.evs = {
+            ev: _StandIn(ev, Battery(soc)) for ev, soc in zip(evs.tolist(), socs)
+        }
+        self.clock.now = t + 1
+        p, vpp, r, i = self.controller.charge_fleet(t)
+
+        rb, ri = self.controller.risk
+        self.results.add(
+            ResultEntry(
+                timestamp=t,
+                profit_eur=p,
+                lost_rentals_eur=lost_eur,
+                lost_rentals_nb=lost_nb,
+                charged_regular_kwh=r,
+                charged_vpp_kwh=vpp,
+                imbalance_kwh=i,
+                risk_bal=rb,
+                risk_intr=ri,
+            )
+        )
+
+        self.slot += 1
+        return self.controller.account.balance, self.done
+
+    def _slot(self, i):
+        trace = self.trace
+        lo, hi = trace["offsets"][i], trace["offsets"][i + 1]
+        dlo, dhi = trace["departure_offsets"][i], trace["departure_offsets"][i + 1]
+        departures = (
+            trace["departure_evs"][dlo:dhi].tolist(),
+            trace["departure_socs"][dlo:dhi],
+            trace["departure_prices"][dlo:dhi],
+        )
+        return trace["evs"][lo:hi], trace["socs"][lo:hi], departures
+
+
+class _StandIn:
+    """Light EV in a replayed VPP, its SoC is given by the trace"""
+
+    __slots__ = ("id", "name", "battery", "action")
+
+    def __init__(self, id, battery):
+        self.id = id
+        self.name = id
+        self.battery = battery
+        self.action = None
+
+    def charge_timestep(self):
+        pass
+
+
+def _offsets(slots):
+    return np.concatenate([[0], np.cumsum([len(s) for s in slots])]).astype(np.int64)
+
+
+def _concat(arrays, dtype):
+    if not arrays:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype)
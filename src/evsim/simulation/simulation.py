@@ -1,11 +1,16 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime
 import logging
-import pandas as pd
+import numpy as np
+import random
 import simpy
 
 from . import Statistic, SimEntry, ResultEntry
+from .memprofile import MemoryProfile
+from .profile import NullProfile, Profile
+from .progress import Progress
 from evsim import entities
+from evsim.controller import strategy
 from evsim.data import load
 
 logger = logging.getLogger(__name__)
@@ -18,9 +23,34 @@ class SimulationConfig:
     ev_capacity: float = 17.6
     industry_tariff: float = 150
 
+    # Time grid in minutes: The fleet is controlled every control period,
+    # energy is traded for market periods of several control periods
+    control_period: int = 5
+    market_period: int = 15
+
+    def __post_init__(self):
+        if self.market_period % self.control_period != 0:
+            raise ValueError(
+                "Market period of %d min is not a multiple of the control period "
+                "of %d min." % (self.market_period, self.control_period)
+            )
+
+    @property
+    def timeslot(self):
+        """Control period in seconds"""
+        return self.control_period * 60
+
 
 class Simulation:
-    def __init__(self, cfg, controller):
+    def __init__(
+        self,
+        cfg,
+        controller,
+        trips=None,
+        start_time=None,
+        end_time=None,
+        skip_quiet=True,
+    ):
 
         self.cfg = cfg
 
@@ -29,15 +59,48 @@ class Simulation:
 
         self.controller = controller
 
-        self.trips = load.car2go_trips(False)
-
-        self.env = simpy.Environment(initial_time=self.trips.start_time.min())
+        self.trips = load.car2go_trips(False) if trips is None else trips
+        if not self.trips["start_time"].is_monotonic_increasing:
+            self.trips = self.trips.sort_values("start_time", kind="mergesort")
+        self.start_time = int(self.trips.start_time.min())
+        self.start_time -= self.start_time % cfg.timeslot
+        self.end_time = int(self.trips.end_time.max())
+
+        # Simulate a time window only, e.g. one shard of a parallel run
+        # NOTE: Start has to be on the grid of the control period
+        if start_time is not None:
+            self.start_time = start_time
+        if end_time is not None:
+            self.end_time = end_time
+
+        # Cursor to the trips, which have not been started yet
+        self.trip_starts = self.trips["start_time"].values
+        self.trip_cursor = int(np.searchsorted(self.trip_starts, self.start_time))
+
+        self.env = simpy.Environment(initial_time=self.start_time)
         self.vpp = entities.VPP(
-            self.env, "VPP", len(self.trips.EV.unique()), cfg.charging_power
+            self.env, "VPP", len(self.trips.EV.cat.categories), cfg.charging_power
         )
+        self.evs = dict()
 
         self.done = False
 
+        # Skip timeslots, in which nothing changes, see _skip_quiet
+        # NOTE: Turn off when changing the controller between steps
+        self.skip_quiet = skip_quiet
+
+        # Optional recorder of the VPP availability, see replay.TraceRecorder
+        self.trace = None
+
+        # Timings of the lifecycle phases, see enable_profile
+        self.profile = NullProfile()
+
+        # Optional progress reporter, see enable_progress
+        self.progress = None
+
+        # Optional memory snapshots, see enable_memprofile
+        self.memprofile = None
+
         # Pass references to controller
         self.controller.env = self.env
         self.controller.vpp = self.vpp
@@ -49,6 +112,11 @@ class Simulation:
         logger.info("---- STARTING SIMULATION: %s -----" % self.cfg.name)
         while not self.done:
             self.step()
+        self.profile.stop()
+        if self.progress is not None:
+            self.progress.close()
+        if self.memprofile is not None:
+            self.memprofile.stop()
 
         logger.info("---- RESULTS: %s -----" % self.cfg.name)
 
@@ -70,27 +138,139 @@ class Simulation:
         self.stats.write("./logs/stats-%s.csv" % self.cfg.name)
         self.results.write("./results/%s.csv" % self.cfg.name)
 
-    def step(self, risk=None, minutes=5):
+    def step(self, risk=None, minutes=None):
+        """Simulates the given minutes, one control period by default"""
         if risk:
             self.controller.risk = risk
+        if minutes is None:
+            minutes = self.cfg.control_period
 
-        if self.env.peek() > self.trips.end_time.max():
+        if self.env.peek() > self.end_time:
             self.done = True
         else:
             self.env.run(until=(self.env.now + (60 * minutes)))
 
+        if self.progress is not None:
+            self.progress.update(self, force=self.done)
+        if self.memprofile is not None:
+            self.memprofile.update(self, force=self.done)
+
         return self.controller.account.balance, self.done
 
+    def enable_profile(self):
+        """Times the phases of the lifecycle and counts SimPy events,
+        processes and bids from now on.
+        """
+        self.profile = Profile()
+        self.profile.attach(self.env)
+        self.controller.profile = self.profile
+        return self.profile
+
+    def enable_progress(self, interval=10, metrics=None, echo=None):
+        """Reports the progress every interval of wall time in seconds from
+        now on, and appends it to a metrics file of JSON lines if given.
+        """
+        self.progress = Progress(self, interval, metrics, echo)
+        return self.progress
+
+    def enable_memprofile(self, every, top=10):
+        """Snapshots the memory every interval of simulated time in seconds
+        from now on, see MemoryProfile.
+        """
+        self.memprofile = MemoryProfile(self, every, top)
+        return self.memprofile
+
+    def state(self):
+        """State of the simulation between two timeslots, e.g. to checkpoint"""
+        controller = self.controller
+        return {
+            "cfg": self.cfg,
+            "now": self.env.now,
+            "end_time": self.end_time,
+            "trips": self.trips_key(),
+            "trip_cursor": self.trip_cursor,
+            "evs": [
+                (ev.id, ev.name, ev.battery.level, ev.available, ev.charging, ev.trip)
+                for ev in self.evs.values()
+            ],
+            "vpp": list(self.vpp.evs),
+            "strategy": controller.strategy.__name__,
+            "accuracy": controller.accuracy,
+            "risk": controller.risk,
+            "imbalance_costs": controller.imbalance_costs,
+            "refuse_rentals": controller.refuse_rentals,
+            "balancing_plan": dict(controller.balancing_plan.plan),
+            "intraday_plan": dict(controller.intraday_plan.plan),
+            "account": dict(vars(controller.account)),
+            # NOTE: Skipped timeslots are filled ahead of the clock
+            "stats": [s for s in self.stats.stats if s["timestamp"] < self.env.now],
+            "results": [r for r in self.results.stats if r["timestamp"] < self.env.now],
+            "random": random.getstate(),
+        }
+
+    def trips_key(self):
+        """Number, first start and last end of the trips, to tell them apart"""
+        return (
+            len(self.trips),
+            int(self.trips["start_time"].iloc[0]),
+            int(self.trips["end_time"].max()),
+        )
+
+    def restore(self, state, random_state=True):
+        """Restores the fleet, VPP, plans and statistics of a state. The
+        simulation has to start at the time of the state.
+        """
+        if self.env.now != state["now"]:
+            raise ValueError(
+                "Simulation starts at %s, but state is at %s."
+                % (
+                    datetime.fromtimestamp(self.env.now),
+                    datetime.fromtimestamp(state["now"]),
+                )
+            )
+
+        self.trip_cursor = state["trip_cursor"]
+        for ev_id, name, soc, available, charging, trip in state["evs"]:
+            ev = entities.EV(
+                self.env,
+                self.vpp,
+                ev_id,
+                name,
+                soc,
+                self.cfg.ev_capacity,
+                self.cfg.charging_power,
+                self.cfg.control_period,
+            )
+            ev.available = available
+            ev.charging = charging
+            ev.trip = trip
+            self.evs[ev_id] = ev
+
+        for ev_id in state["vpp"]:
+            self.vpp.add(self.evs[ev_id])
+
+        # Continue trips in progress, in order of their arrival
+        driving = [ev for ev in self.evs.values() if ev.trip is not None]
+        for ev in sorted(driving, key=lambda ev: ev.trip[1]):
+            self.env.process(ev.resume(self.controller.account))
+
+        self.controller.balancing_plan.plan = dict(state["balancing_plan"])
+        self.controller.intraday_plan.plan = dict(state["intraday_plan"])
+        vars(self.controller.account).update(state["account"])
+
+        self.stats.stats = list(state["stats"])
+        self.results.stats = list(state["results"])
+        if random_state:
+            random.setstate(state["random"])
+
     def lifecycle(self):
-        evs = {}
+        evs = self.evs
+        timeslot = self.cfg.timeslot
 
-        # Timerange from start to end in 5 minute intervals
-        timeslots = pd.date_range(
-            datetime.utcfromtimestamp(self.trips.start_time.min()),
-            datetime.utcfromtimestamp(self.trips.end_time.max()),
-            freq="5min",
-        )
-        for _ in timeslots:
+        # Last timeslot in control periods from start to end
+        last_slot = self.env.now + (self.end_time - self.env.now) // timeslot * timeslot
+        while self.env.now <= last_slot:
+            self.profile.mark()
             logger.info(
                 "[%s] - ---------- TIMESLOT %s ----------"
                 % (
@@ -102,23 +282,37 @@ class Simulation:
             # 1. Allocate consumption plan
             self.vpp.commited_capacity = self.controller.planned_kw(self.env.now)
 
-            # 2. Find trips at the timeslot
-            starting_trips = self.trips.loc[self.trips["start_time"] == self.env.now]
+            if self.trace is not None:
+                vpp_evs = set(self.vpp.evs)
+            self.profile.lap("plan")
+
+            # 2. Find trips starting in the timeslot
+            starts = self.trip_starts[self.trip_cursor :]
+            first, last = self.trip_cursor + np.searchsorted(
+                starts, [self.env.now, self.env.now + timeslot]
+            )
+            starting_trips = self.trips.iloc[first:last]
+            self.trip_cursor = int(last)
+            self.profile.lap("trip_lookup")
 
             for trip in starting_trips.itertuples():
                 # 3. Add EVs to Fleet
-                if trip.EV not in evs:
-                    evs[trip.EV] = entities.EV(
+                if trip.ev_id not in evs:
+                    self.profile.lap("start_trips")
+                    evs[trip.ev_id] = entities.EV(
                         self.env,
                         self.vpp,
+                        trip.ev_id,
                         trip.EV,
                         trip.start_soc,
                         self.cfg.ev_capacity,
                         self.cfg.charging_power,
+                        self.cfg.control_period,
                     )
+                    self.profile.lap("ev_creation")
 
                 # 4. Start trip with EV
-                ev = evs[trip.EV]
+                ev = evs[trip.ev_id]
                 self.env.process(
                     ev.drive(
                         trip.Index,
@@ -130,26 +324,28 @@ class Simulation:
                         refuse=self.controller.refuse_rentals,
                     )
                 )
+            self.profile.count("processes", int(last - first))
+            self.profile.lap("start_trips")
 
             # NOTE: Wait 1 sec later let all trips start first
             yield self.env.timeout(1)
+            self.profile.mark()
 
             # 5. Save simulation stats
-            self.stats.add(
-                SimEntry(
-                    timestamp=self.env.now - 1,
-                    fleet_evs=len(evs),
-                    fleet_soc=self._fleet_soc(evs),
-                    available_evs=self._fleet_available(evs),
-                    charging_evs=self._fleet_charging(evs),
-                    vpp_soc=self.vpp.avg_soc(),
-                    vpp_evs=len(self.vpp.evs),
-                    vpp_charging_power_kw=self.vpp.capacity(),
-                )
-            )
+            self.stats.add(self._sim_entry(self.env.now - 1))
+
+            if self.trace is not None:
+                departures = [
+                    (evs[trip.ev_id], trip.trip_price)
+                    for trip in starting_trips.itertuples()
+                    if trip.ev_id in vpp_evs and not self.vpp.contains(evs[trip.ev_id])
+                ]
+                self.trace.record(self.env.now - 1, self.vpp, departures)
+            self.profile.lap("stats")
 
             # 6. Centrally control charging
             p, vpp, r, i = self.controller.charge_fleet(self.env.now - 1)
+            self.profile.lap("charge_fleet")
 
             # NOTE: Think of other way to pass rental costs back from EV
             lost_rentals_eur = self.controller.account.lost_rental_eur
@@ -170,9 +366,99 @@ class Simulation:
                     risk_intr=ri,
                 )
             )
+            self.profile.count("timeslots")
+            self.profile.lap("results")
+
+            # 7. Fast-forward over the following quiet timeslots
+            skipped = self._skip_quiet(self.env.now - 1, last_slot)
+            self.profile.count("skipped_timeslots", skipped)
+            self.profile.lap("skip")
+
+            # 8. Wait for the next control period
+            yield self.env.timeout(timeslot * (1 + skipped) - 1)
+
+    def _sim_entry(self, timestamp):
+        evs = self.evs
+        return SimEntry(
+            timestamp=timestamp,
+            fleet_evs=len(evs),
+            fleet_soc=self._fleet_soc(evs),
+            available_evs=self._fleet_available(evs),
+            charging_evs=self._fleet_charging(evs),
+            vpp_soc=self.vpp.avg_soc(),
+            vpp_evs=len(self.vpp.evs),
+            vpp_charging_power_kw=self.vpp.capacity(),
+        )
 
-            # 7. Wait 5 min timestep
-            yield self.env.timeout((5 * 60) - 1)
+    def _skip_quiet(self, timeslot, last_slot):
+        """Fills the statistics of the timeslots after the given one, in which
+        nothing changes: No trip starts or ends, the VPP is empty, nothing is
+        planned and the strategy does not bid. Returns the number of
+        timeslots, which the lifecycle can skip.
+        """
+        if not self.skip_quiet or self.trace is not None or self.vpp.evs:
+            return 0
+
+        period = self.cfg.timeslot
+
+        # Trips starting in the next timeslots
+        until = last_slot
+        if self.trip_cursor < len(self.trip_starts):
+            next_start = int(self.trip_starts[self.trip_cursor])
+            start_slot = timeslot + (next_start - timeslot) // period * period
+            until = min(until, start_slot - 1)
+
+        controller = self.controller
+        wake = timeslot + period
+        while (
+            wake <= until
+            and controller.balancing_plan.get(wake) == 0
+            and controller.intraday_plan.get(wake) == 0
+            and not strategy.may_bid(controller.strategy, wake, self.cfg.market_period)
+        ):
+            wake += period
+
+        # Arriving EVs change the fleet, from the timeslot they arrive in
+        # NOTE: The stats of a timeslot include events until 1 sec later
+        if wake > timeslot + period:
+            arrivals = [ev.trip[1] for ev in self.evs.values() if ev.trip is not None]
+            if arrivals:
+                slots = -(-(min(arrivals) - 1 - timeslot) // period)
+                wake = min(wake, timeslot + slots * period)
+
+        skipped = max(0, (wake - timeslot) // period - 1)
+        if skipped == 0:
+            return 0
+
+        logger.info(
+            "[%s] - Skipping %d quiet timeslots until %s."
+            % (
+                datetime.fromtimestamp(self.env.now),
+                skipped,
+                datetime.fromtimestamp(wake),
+            )
+        )
+
+        # Nothing is dispatched, accounted or lost in quiet timeslots
+        self.vpp.commited_capacity = 0
+        entry = self._sim_entry(timeslot)
+        rb, ri = controller.risk
+        for t in range(timeslot + period, wake, period):
+            self.stats.add(replace(entry, timestamp=t))
+            self.results.add(
+                ResultEntry(
+                    timestamp=t,
+                    profit_eur=0,
+                    lost_rentals_eur=0,
+                    lost_rentals_nb=0,
+                    charged_regular_kwh=0.0,
+                    charged_vpp_kwh=0.0,
+                    imbalance_kwh=0,
+                    risk_bal=rb,
+                    risk_intr=ri,
+                )
+            )
+        return skipped
 
     def _fleet_soc(self, evs):
         if len(evs) == 0:
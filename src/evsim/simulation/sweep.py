@@ -0,0 +1,275 @@
+from dataclasses import replace
+from datetime import datetime
+import itertools
+import logging
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from evsim.controller import Controller, strategy
+from evsim.data import load
+from . import Statistic
+from .lockstep import LockstepSimulation
+from .simulation import Simulation
+
+logger = logging.getLogger(__name__)
+
+# Scenario parameters of a sweep and their defaults
+PARAMETERS = {
+    "charging_strategy": "regular",
+    "risk": (0.0, 0.0),
+    "accuracy": (100, 100),
+    "refuse_rentals": True,
+}
+
+STRATEGIES = ["regular", "balancing", "intraday", "integrated"]
+
+# Results summed up per scenario or shard
+TOTALS = [
+    "profit_eur",
+    "lost_rentals_eur",
+    "lost_rentals_nb",
+    "charged_regular_kwh",
+    "charged_vpp_kwh",
+    "imbalance_kwh",
+]
+
+# Read-only data shared by all scenarios of a sweep. Loaded once in the parent
+# process, forked workers share the memory pages copy-on-write.
+_data = dict()
+
+
+def grid(spec):
+    """Expands a grid spec, e.g. {"risk": [[0, 0], [0.1, 0.1]]},
+    into the cartesian product of scenarios.
+    """
+    unknown = set(spec) - set(PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown sweep parameters: %s" % ", ".join(sorted(unknown)))
+
+    values = list()
+    for param, default in PARAMETERS.items():
+        v = spec.get(param, [default])
+        values.append(v if isinstance(v, list) else [v])
+
+    scenarios = list()
+    for combination in itertools.product(*values):
+        scenario = dict(zip(PARAMETERS, combination))
+        scenario["risk"] = tuple(scenario["risk"])
+        scenario["accuracy"] = tuple(scenario["accuracy"])
+        if scenario["charging_strategy"] not in STRATEGIES:
+            raise ValueError(
+                "Unknown charging strategy: %s" % scenario["charging_strategy"]
+            )
+        scenarios.append(scenario)
+    return scenarios
+
+
+def load_data(scenarios, synthetic=None):
+    """Loads the data needed by the scenarios once, with the car2go trips
+    or the trips of a synthetic fleet.
+    """
+    if synthetic is None:
+        data = {"trips": load.car2go_trips()}
+    else:
+        data = {"trips": load.synthetic_trips(synthetic)}
+    if any(s["charging_strategy"] != "regular" for s in scenarios):
+        data["fleet_capacity"] = load.simulation_baseline()
+        data["balancing_prices"] = load.balancing_prices()
+        data["intraday_prices"] = load.intraday_prices()
+    return data
+
+
+def run(cfg, scenarios, processes=None, lockstep=False, synthetic=None):
+    """Runs all scenarios on a process pool and returns their results
+    combined in one table. In lockstep mode, every worker simulates its
+    share of the scenarios in one pass over the trips.
+    """
+    logger.info("Running %d scenarios of sweep %s..." % (len(scenarios), cfg.name))
+    if lockstep:
+        processes = min(processes or multiprocessing.cpu_count(), len(scenarios))
+        batches = [list(enumerate(scenarios))[i::processes] for i in range(processes)]
+        tasks = [(cfg, batch) for batch in batches]
+        worker = _run_lockstep
+    else:
+        tasks = [(cfg, i, s) for i, s in enumerate(scenarios)]
+        worker = _run_scenario
+
+    with _pool(scenarios, processes, synthetic) as pool:
+        results = list(pool.imap_unordered(worker, tasks))
+
+    df = pd.concat(results, ignore_index=True)
+    return df.sort_values(["scenario", "timestamp"]).reset_index(drop=True)
+
+
+def summary(df):
+    """Totals of every scenario in a combined results table"""
+    params = ["scenario", "charging_strategy", "accuracy_bal", "accuracy_intr"]
+    params += ["risk_bal", "risk_intr", "refuse_rentals"]
+    return df.groupby(params)[TOTALS].sum().reset_index()
+
+
+def shards(start_time, end_time, freq, timeslot=300):
+    """Splits the timeslots (in seconds) from start to end time into
+    windows at the given frequency, e.g. "MS" for one window per month.
+    """
+    bounds = pd.date_range(
+        datetime.utcfromtimestamp(start_time),
+        datetime.utcfromtimestamp(end_time),
+        freq=freq,
+    )
+    # Align to the timeslots of the simulation
+    bounds = (bounds.values.astype(np.int64) // 10 ** 9) - start_time
+    bounds = start_time + np.ceil(bounds / timeslot).astype(np.int64) * timeslot
+    starts = [start_time] + sorted(int(b) for b in set(bounds) if b > start_time)
+    starts = [s for s in starts if s <= end_time]
+    ends = [s - timeslot for s in starts[1:]] + [end_time]
+    return list(zip(starts, ends))
+
+
+def run_sharded(
+    cfg, scenario, freq="MS", warmup_days=7, processes=None, synthetic=None
+):
+    """Runs one scenario split into time shards on a process pool.
+
+    Every shard starts a warm-up period early, to build up the SoC of the
+    fleet, the VPP and the consumption plans. Stats and results of the
+    warm-up are discarded, before the shards are stitched together.
+    """
+    with _pool([scenario], processes, synthetic) as pool:
+        trips = _data["trips"]
+        start_time = int(trips.start_time.min())
+        start_time -= start_time % cfg.timeslot
+        windows = shards(start_time, int(trips.end_time.max()), freq, cfg.timeslot)
+        warmup = warmup_days * 24 * 60 * 60
+        tasks = [
+            (cfg, i, scenario, start, end, max(windows[0][0], start - warmup))
+            for i, (start, end) in enumerate(windows)
+        ]
+        logger.info(
+            "Running scenario %s in %d shards of %s..." % (scenario, len(tasks), freq)
+        )
+        results = pool.map(_run_shard, tasks)
+
+    stats, sim_results = Statistic(), Statistic()
+    for s, r in results:
+        stats.stats.extend(s)
+        sim_results.stats.extend(r)
+    return stats, sim_results, windows
+
+
+def boundary_error(results, sequential, windows):
+    """Difference of the totals of every shard of a sharded run to a
+    sequential run of the same scenario. Errors stem from the state, which
+    the warm-up could not rebuild at the start of the shard.
+    """
+    starts = np.array([start for start, _ in windows])
+    errors = list()
+    for df in (results, sequential):
+        df = pd.DataFrame(df.stats)
+        shard = np.searchsorted(starts, df["timestamp"].values, side="right") - 1
+        errors.append(df.groupby(shard)[TOTALS].sum())
+
+    df = errors[0] - errors[1]
+    df.insert(0, "shard_start", [datetime.utcfromtimestamp(s) for s in starts])
+    return df
+
+
+def _pool(scenarios, processes, synthetic=None):
+    """Process pool whose workers share the data needed by the scenarios"""
+    _data.clear()
+    _data.update(load_data(scenarios, synthetic))
+
+    # Without fork, workers have to load the data on their own
+    if "fork" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("fork")
+        initargs = (None, None)
+    else:
+        ctx = multiprocessing.get_context()
+        initargs = (scenarios, synthetic)
+
+    return ctx.Pool(processes, initializer=_init_worker, initargs=initargs)
+
+
+def _init_worker(scenarios, synthetic):
+    if scenarios is not None:
+        _data.update(load_data(scenarios, synthetic))
+
+
+def _run_scenario(task):
+    cfg, i, scenario = task
+    controller = _controller(cfg, i, scenario)
+    sim = Simulation(controller.cfg, controller, trips=_data["trips"])
+
+    logger.info("Starting scenario %s: %s" % (controller.cfg.name, scenario))
+    while not sim.done:
+        sim.step()
+
+    return _results(i, scenario, sim.results)
+
+
+def _run_lockstep(task):
+    cfg, batch = task
+    controllers = [_controller(cfg, i, scenario) for i, scenario in batch]
+    sim = LockstepSimulation(cfg, controllers, trips=_data["trips"])
+
+    logger.info("Starting scenarios %s in lockstep" % [i for i, _ in batch])
+    while not sim.done:
+        sim.step()
+
+    return pd.concat(
+        _results(i, scenario, results)
+        for (i, scenario), results in zip(batch, sim.results)
+    )
+
+
+def _run_shard(task):
+    cfg, i, scenario, start, end, warmup_start = task
+    controller = _controller(cfg, i, scenario)
+    sim = Simulation(
+        controller.cfg,
+        controller,
+        trips=_data["trips"],
+        start_time=warmup_start,
+        end_time=end,
+    )
+
+    logger.info(
+        "Starting shard %s from %s (warm-up from %s)"
+        % (
+            controller.cfg.name,
+            datetime.utcfromtimestamp(start),
+            datetime.utcfromtimestamp(warmup_start),
+        )
+    )
+    while not sim.done:
+        sim.step()
+
+    # Discard warm-up
+    stats = [s for s in sim.stats.stats if s["timestamp"] >= start]
+    results = [r for r in sim.results.stats if r["timestamp"] >= start]
+    return stats, results
+
+
+def _controller(cfg, i, scenario):
+    cfg = replace(cfg, name="%s-%03d" % (cfg.name, i))
+    return Controller(
+        cfg,
+        getattr(strategy, scenario["charging_strategy"]),
+        accuracy=scenario["accuracy"],
+        risk=scenario["risk"],
+        refuse_rentals=scenario["refuse_rentals"],
+        fleet_capacity=_data.get("fleet_capacity"),
+        balancing_prices=_data.get("balancing_prices"),
+        intraday_prices=_data.get("intraday_prices"),
+    )
+
+
+def _results(i, scenario, results):
+    df = pd.DataFrame(results.stats)
+    df.insert(0, "scenario", i)
+    df.insert(1, "charging_strategy", scenario["charging_strategy"])
+    df.insert(2, "accuracy_bal", scenario["accuracy"][0])
+    df.insert(3, "accuracy_intr", scenario["accuracy"][1])
+    df["refuse_rentals"] = scenario["refuse_rentals"]
+    return df